@@ -5,38 +5,106 @@
 # python3 -m scripts.run_ingestion (now it will run on the entire document)
 
 import asyncio
-from typing import Optional, List
-from tqdm import tqdm
+import logging
+from typing import Optional, List, AsyncIterator
+from tqdm.asyncio import tqdm
+from motor.motor_asyncio import AsyncIOMotorClient
 from rag_strategies.ingestion.processor import DocumentProcessor
 from rag_strategies.config import settings
 from rag_strategies.utils.logger import setup_logger
-import math
+from rag_strategies.utils.openai_client import enable_embedding_cache, enable_llm_cache
 
 logger = setup_logger(__name__)
 
-async def get_unique_root_ids(processor: DocumentProcessor) -> List[str]:
-    """Get all unique root IDs from ComponentPath field"""
-    try:
-        pipeline = [
-            {
-                "$project": {
-                    "root_id": {"$substr": ["$ComponentPath", 0, {"$indexOfCP": ["$ComponentPath", "_"]}]}
+NUM_WORKERS = 10
+CONCURRENCY_PER_WORKER = 4
+
+# $match first so the ComponentPath index can be used, and carry only
+# ComponentPath into $group so the hinted index covers the query.
+# A path without "_" is its own root ($substrCP rejects the -1 length).
+_UNIQUE_ROOT_IDS_PIPELINE = [
+    {"$match": {"ComponentPath": {"$exists": True, "$ne": ""}}},
+    {"$project": {"_id": 0, "ComponentPath": 1}},
+    {
+        "$group": {
+            "_id": {
+                "$let": {
+                    "vars": {"separator": {"$indexOfCP": ["$ComponentPath", "_"]}},
+                    "in": {
+                        "$cond": [
+                            {"$lt": ["$$separator", 0]},
+                            "$ComponentPath",
+                            {"$substrCP": ["$ComponentPath", 0, "$$separator"]}
+                        ]
+                    }
                 }
-            },
-            {"$group": {"_id": "$root_id"}},
-            {"$sort": {"_id": 1}}
-        ]
-        
-        results = await processor.docs_collection.aggregate(pipeline).to_list(None)
-        root_ids = [doc["_id"] for doc in results]
-        logger.info(f"Found {len(root_ids)} unique root IDs")
-        logger.info(f"Sample root IDs: {root_ids[:5] if len(root_ids) > 5 else root_ids}")
-        return root_ids
+            }
+        }
+    }
+]
+
+# Root IDs stored in chunks or summaries with no source document left under
+# the "<root_id>_" prefix; the range $expr can use the ComponentPath index
+# ("`" is the character after "_")
+_STALE_ROOT_IDS_PIPELINE = [
+    {"$project": {"_id": 0, "root_id": 1}},
+    {"$group": {"_id": "$root_id"}},
+    {
+        "$unionWith": {
+            "coll": settings.mongodb_summary_collection,
+            "pipeline": [{"$project": {"_id": "$root_id"}}]
+        }
+    },
+    {"$group": {"_id": "$_id"}},
+    {"$match": {"_id": {"$type": "string"}}},
+    {
+        "$lookup": {
+            "from": settings.mongodb_collection_name,
+            "let": {"root_id": "$_id"},
+            "pipeline": [
+                {
+                    "$match": {
+                        "$expr": {
+                            "$and": [
+                                {"$gte": ["$ComponentPath", {"$concat": ["$$root_id", "_"]}]},
+                                {"$lt": ["$ComponentPath", {"$concat": ["$$root_id", "`"]}]}
+                            ]
+                        }
+                    }
+                },
+                {"$limit": 1},
+                {"$project": {"_id": 1}}
+            ],
+            "as": "sources"
+        }
+    },
+    {"$match": {"sources": {"$size": 0}}},
+    {"$project": {"_id": 1}}
+]
+_SWEEP_BATCH_SIZE = 1000
+
+async def iter_unique_root_ids(processor: DocumentProcessor) -> AsyncIterator[str]:
+    """Stream unique root IDs from ComponentPath field"""
+    try:
+        cursor = processor.docs_collection.aggregate(
+            _UNIQUE_ROOT_IDS_PIPELINE,
+            hint={"ComponentPath": 1},
+            allowDiskUse=True,
+            batchSize=5000,
+            maxTimeMS=600000
+        )
+        async for doc in cursor:
+            yield doc["_id"]
 
     except Exception as e:
         logger.error(f"Error getting unique root IDs: {str(e)}")
         raise
 
+async def iter_root_ids(root_ids: List[str]) -> AsyncIterator[str]:
+    """Async iterator over a predefined list of root IDs"""
+    for root_id in root_ids:
+        yield root_id
+
 async def verify_collections_and_indexes(processor):
     """Verify collections exist and create required indexes"""
     try:
@@ -52,8 +120,12 @@ async def verify_collections_and_indexes(processor):
                 await processor.db.create_collection(collection_name)
         
         logger.info("Setting up indexes...")
-        await processor.chunks_collection.create_index([("summary_id", 1)])
-        await processor.summary_collection.create_index([("root_id", 1)], unique=True)
+        await asyncio.gather(
+            processor.docs_collection.create_index([("ComponentPath", 1)], background=True),
+            processor.chunks_collection.create_index([("summary_id", 1)], background=True),
+            processor.chunks_collection.create_index([("root_id", 1), ("content_hash", 1)], background=True),
+            processor.summary_collection.create_index([("root_id", 1)], unique=True, background=True)
+        )
         
         logger.info("Collections and indexes verified")
         
@@ -61,27 +133,94 @@ async def verify_collections_and_indexes(processor):
         logger.error(f"Error in collection/index verification: {str(e)}")
         raise
 
-async def process_batch(processor: DocumentProcessor, root_ids_batch: List[str], worker_id: int) -> tuple:
-    """Process a batch of root IDs"""
+async def enqueue_root_ids(
+    root_ids: AsyncIterator[str],
+    queue: asyncio.Queue,
+    num_workers: int
+) -> int:
+    """Hand root IDs to the workers as they stream in, returning how many were queued"""
+    queued = 0
+    try:
+        async for root_id in root_ids:
+            # Blocks while the queue is full, so the cursor is read only as fast as workers drain it
+            await queue.put(root_id)
+            queued += 1
+    finally:
+        # One stop signal per worker
+        for _ in range(num_workers):
+            await queue.put(None)
+
+    logger.info(f"Queued {queued} root IDs")
+    return queued
+
+async def sweep_deleted_roots(processor: DocumentProcessor):
+    """Delete chunks and summaries of root IDs that no longer have source documents"""
+
+    async def delete_roots(stale_root_ids: List[str]):
+        await asyncio.gather(
+            processor.chunks_collection.delete_many({"root_id": {"$in": stale_root_ids}}),
+            processor.summary_collection.delete_many({"root_id": {"$in": stale_root_ids}})
+        )
+
+    try:
+        # The comparison runs server-side; only stale IDs are streamed back, a batch at a time
+        cursor = processor.chunks_collection.aggregate(
+            _STALE_ROOT_IDS_PIPELINE,
+            hint={"root_id": 1, "content_hash": 1},
+            allowDiskUse=True,
+            batchSize=_SWEEP_BATCH_SIZE,
+            maxTimeMS=600000
+        )
+        removed = 0
+        stale_root_ids = []
+        async for doc in cursor:
+            stale_root_ids.append(doc["_id"])
+            if len(stale_root_ids) >= _SWEEP_BATCH_SIZE:
+                await delete_roots(stale_root_ids)
+                removed += len(stale_root_ids)
+                stale_root_ids = []
+        if stale_root_ids:
+            await delete_roots(stale_root_ids)
+            removed += len(stale_root_ids)
+
+        if removed:
+            logger.info(f"Removed content of {removed} deleted root IDs")
+
+    except Exception as e:
+        logger.error(f"Error sweeping deleted root IDs: {str(e)}")
+        raise
+
+async def process_queue(
+    processor: DocumentProcessor,
+    queue: asyncio.Queue,
+    worker_id: int,
+    pbar: tqdm
+) -> tuple:
+    """Pull root IDs off the shared queue until a stop signal is received"""
     successful = 0
     failed = 0
     
-    logger.info(f"Worker {worker_id} starting to process {len(root_ids_batch)} root IDs")
-    logger.info(f"Worker {worker_id} batch range: {root_ids_batch[0]} to {root_ids_batch[-1]}")
+    logger.info(f"Worker {worker_id} starting")
+    process_root_documents = processor.process_root_documents
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
     
-    for root_id in root_ids_batch:
+    while True:
+        root_id = await queue.get()
+        if root_id is None:
+            queue.task_done()
+            break
+
         try:
-            # Delete existing data for this root_id before processing
-            logger.info(f"Worker {worker_id} - Cleaning up existing data for root_id: {root_id}")
-            await processor.chunks_collection.delete_many({"root_id": root_id})
-            await processor.summary_collection.delete_many({"root_id": root_id})
-            
-            await processor.process_root_documents(root_id)
+            await process_root_documents(root_id)
             successful += 1
-            logger.info(f"Worker {worker_id} - Successfully processed root_id: {root_id}")
-        except Exception as e:
-            logger.error(f"Worker {worker_id} - Error processing root_id {root_id}: {str(e)}")
+            if debug_enabled:
+                logger.debug("Worker %d - Successfully processed root_id: %s", worker_id, root_id)
+        except Exception:
+            logger.exception("Worker %d - Error processing root_id %s", worker_id, root_id)
             failed += 1
+        finally:
+            queue.task_done()
+            pbar.update(1)
     
     logger.info(f"Worker {worker_id} completed: {successful} successful, {failed} failed")
     return successful, failed
@@ -91,66 +230,73 @@ async def run_ingestion(root_id: Optional[str] = None):
     ROOT_IDS = []
 
     logger.info("Starting ingestion process...")
-    processor = await DocumentProcessor.create()
+    # Re-ingesting unchanged content replays identical summary/labeling prompts
+    enable_llm_cache()
+    enable_embedding_cache()
+    # One Motor client (and connection pool) shared by every processor
+    client = AsyncIOMotorClient(
+        settings.mongodb_uri,
+        maxPoolSize=NUM_WORKERS * CONCURRENCY_PER_WORKER
+    )
     
     try:
-        await verify_collections_and_indexes(processor)
-        
         if root_id:
-            logger.info(f"Cleaning up existing data for root_id: {root_id}")
-            await processor.chunks_collection.delete_many({"root_id": root_id})
-            await processor.summary_collection.delete_many({"root_id": root_id})
+            processor = await DocumentProcessor.create(client)
+            await verify_collections_and_indexes(processor)
             
+            # Stale chunks and summaries are replaced per root_id by the processor
             # Process specific root_id
             logger.info(f"Processing single root_id: {root_id}")
             await processor.process_root_documents(root_id)
             logger.info(f"Completed processing root_id: {root_id}")
         else:
-            logger.info("Starting batch processing for all root IDs")
-            
-            # Use predefined ROOT_IDS instead of querying the database
-            root_ids = ROOT_IDS
-            total_roots = len(root_ids)
-            
-            num_workers = 10
-            batch_size = math.ceil(total_roots / num_workers)
+            logger.info("Starting queue-based processing for all root IDs")
             
-            batches = []
-            for i in range(0, total_roots, batch_size):
-                batch = root_ids[i:min(i + batch_size, total_roots)]
-                batches.append(batch)
-            
-            logger.info(f"Created {len(batches)} batches:")
-            for i, batch in enumerate(batches):
-                logger.info(f"Batch {i+1}: Size={len(batch)}, First={batch[0]}, Last={batch[-1]}")
-            
-            processors = [await DocumentProcessor.create() for _ in range(len(batches))]
+            num_workers = NUM_WORKERS
+            processors = [
+                await DocumentProcessor.create(client)
+                for _ in range(num_workers)
+            ]
             logger.info(f"Created {len(processors)} processor instances")
+            await verify_collections_and_indexes(processors[0])
             
-            tasks = []
-            for i, batch in enumerate(batches):
-                task = asyncio.create_task(process_batch(processors[i], batch, i+1))
-                tasks.append(task)
+            # Use predefined ROOT_IDS when set, otherwise stream them from the
+            # database so workers start before the aggregation finishes
+            if ROOT_IDS:
+                root_ids = iter_root_ids(ROOT_IDS)
+            else:
+                root_ids = iter_unique_root_ids(processors[0])
             
-            successful = 0
-            failed = 0
-            batch_results = {}
+            # Workers pull from a single queue so one slow root_id
+            # never holds up a whole pre-assigned batch; the bound keeps
+            # the producer only a little ahead of the workers
+            queue = asyncio.Queue(maxsize=num_workers * 2)
             
-            with tqdm(total=total_roots, desc="Processing root IDs") as pbar:
-                for i, completed_task in enumerate(asyncio.as_completed(tasks)):
-                    batch_successful, batch_failed = await completed_task
-                    successful += batch_successful
-                    failed += batch_failed
-                    batch_results[i] = (batch_successful, batch_failed)
-                    pbar.update(batch_successful + batch_failed)
+            with tqdm(
+                total=len(ROOT_IDS) or None,
+                desc="Processing root IDs",
+                mininterval=1.0
+            ) as pbar:
+                total_roots, *worker_results = await asyncio.gather(
+                    enqueue_root_ids(root_ids, queue, num_workers),
+                    *[
+                        process_queue(processors[i], queue, i + 1, pbar)
+                        for i in range(num_workers)
+                    ]
+                )
             
-            logger.info("\nBatch Processing Results:")
-            for batch_num, (batch_successful, batch_failed) in batch_results.items():
-                logger.info(f"Batch {batch_num + 1}: Successful={batch_successful}, Failed={batch_failed}, "
-                          f"Total={batch_successful + batch_failed}")
+            # Full runs also remove content whose source documents were deleted
+            if not ROOT_IDS:
+                await sweep_deleted_roots(processors[0])
+
+            successful = sum(r[0] for r in worker_results)
+            failed = sum(r[1] for r in worker_results)
             
-            for proc in processors:
-                await proc.cleanup()
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(
+                    "Worker results (successful, failed): %s",
+                    dict(enumerate(worker_results, 1))
+                )
             
             logger.info("=" * 50)
             logger.info("Final Ingestion Summary:")
@@ -158,17 +304,15 @@ async def run_ingestion(root_id: Optional[str] = None):
             logger.info(f"Total Successful: {successful}")
             logger.info(f"Total Failed: {failed}")
             logger.info(f"Total Processed: {successful + failed}")
-            logger.info(f"Number of Batches: {len(batches)}")
-            logger.info(f"Batch Size: {batch_size}")
+            logger.info(f"Number of Workers: {num_workers}")
             logger.info("=" * 50)
 
     except Exception as e:
         logger.error(f"Ingestion failed: {str(e)}")
         raise
     finally:
-        if processor:
-            await processor.cleanup()
-            logger.info("Cleanup completed")
+        client.close()
+        logger.info("Cleanup completed")
 
 if __name__ == "__main__":
     import sys
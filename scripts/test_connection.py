@@ -40,7 +40,7 @@ def test_mongodb_connection():
         # Specifically check for 'compiled-answers-testing' collection
         if 'compiled-answers-testing' in collections:
             logger.info("Found 'compiled-answers-testing' collection!")
-            count = db['compiled-answers-testing'].count_documents({})
+            count = db['compiled-answers-testing'].estimated_document_count()
             logger.info(f"Number of documents in compiled-answers-testing: {count}")
         else:
             logger.info("'compiled-answers-testing' collection not found")
@@ -53,12 +53,15 @@ def test_mongodb_connection():
     
 async def test_connections():
     try:
-        # Test OpenAI first
-        await test_openai_connection()
-        logger.info("OpenAI test completed, proceeding to MongoDB test...")
-        
-        # Then test MongoDB
-        test_mongodb_connection()
+        # Both checks are independent; sync pymongo runs off the event loop
+        results = await asyncio.gather(
+            test_openai_connection(),
+            asyncio.to_thread(test_mongodb_connection),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
         logger.info("All connection tests completed successfully!")
     except Exception as e:
         logger.error(f"Connection testing failed: {str(e)}")
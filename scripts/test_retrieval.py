@@ -26,6 +26,7 @@ async def display_response(response: Dict, query: str):
                 print(f"Document Path: {citation['metadata'].get('document_path', 'N/A')}")
 
 async def test_retrieval(
+    rag_system: RAGSystem,
     query: str,
     metadata: Optional[Dict] = None,
     verbose: bool = False
@@ -37,9 +38,6 @@ async def test_retrieval(
         logger.info(f"Processing query: {query}")
     
     try:
-        # Initialize RAG system
-        rag_system = await RAGSystem.create()
-        
         # Process query
         response = await rag_system.process_query(
             query=query,
@@ -56,7 +54,6 @@ async def test_retrieval(
             logger.info(f"Sources used: {response['metadata'].get('sources_used', {})}")
             logger.info(f"Processing time: {response['metadata'].get('processed_at')}")
             
-        await rag_system.cleanup()
         return response
 
     except Exception as e:
@@ -73,32 +70,34 @@ async def run_test_cases():
     ]
     
     results = []
-    for test_case in test_cases:
-        print("\n" + "=" * 80)
-        print(f"Test Case: {test_case['description']}")
-        print("=" * 80)
-        
-        try:
-            response = await test_retrieval(
-                query=test_case['query'],
-                metadata={"test_case": test_case['description']},
-                verbose=False
-            )
+    async with await RAGSystem.create() as rag_system:
+        for test_case in test_cases:
+            print("\n" + "=" * 80)
+            print(f"Test Case: {test_case['description']}")
+            print("=" * 80)
             
-            results.append({
-                "description": test_case['description'],
-                "success": True,
-                "confidence": response.get('confidence', 0),
-                "has_citations": bool(response.get('citations'))
-            })
+            try:
+                response = await test_retrieval(
+                    rag_system=rag_system,
+                    query=test_case['query'],
+                    metadata={"test_case": test_case['description']},
+                    verbose=False
+                )
             
-        except Exception as e:
-            logger.error(f"Test case failed: {str(e)}")
-            results.append({
-                "description": test_case['description'],
-                "success": False,
-                "error": str(e)
-            })
+                results.append({
+                    "description": test_case['description'],
+                    "success": True,
+                    "confidence": response.get('confidence', 0),
+                    "has_citations": bool(response.get('citations'))
+                })
+            
+            except Exception as e:
+                logger.error(f"Test case failed: {str(e)}")
+                results.append({
+                    "description": test_case['description'],
+                    "success": False,
+                    "error": str(e)
+                })
     
     return results
 
@@ -114,11 +113,13 @@ if __name__ == "__main__":
         # TEST_QUERY = "Does an American Express payment need to be included in DTI on FHA?"
         # TEST_QUERY = "Does Self Employment loss need to be included in DTI?"
         TEST_QUERY = "Does Self Employment loss need to be included in DTI for Freddie? are there any exclusions"
-        await test_retrieval(
-            query=TEST_QUERY,
-            metadata={"test_run": True},
-            verbose=True
-        )
+        async with await RAGSystem.create() as rag_system:
+            await test_retrieval(
+                rag_system=rag_system,
+                query=TEST_QUERY,
+                metadata={"test_run": True},
+                verbose=True
+            )
         
         # Uncomment to run all test cases
         # results = await run_test_cases()
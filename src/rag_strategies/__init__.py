@@ -3,7 +3,7 @@ RAG Strategies package for question answering using documents.
 """
 from rag_strategies.utils.logger import setup_logger
 from rag_strategies.config import settings
-from rag_strategies.utils.openai_client import get_llm, get_embeddings_model
+from rag_strategies.utils.openai_client import get_llm, get_embeddings_model, get_openai_client, get_openai_semaphore
 
 __version__ = "0.1.0"
 
@@ -14,6 +14,8 @@ __all__ = [
     'setup_logger',
     'get_llm',
     'get_embeddings_model',
+    'get_openai_client',
+    'get_openai_semaphore',
     'logger',
 ]
 
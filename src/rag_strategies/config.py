@@ -1,4 +1,4 @@
-from pydantic_settings import BaseSettings
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from functools import lru_cache
 
 class Settings(BaseSettings):
@@ -9,9 +9,20 @@ class Settings(BaseSettings):
     openai_model_name: str
     openai_embedding_model: str
     openai_embedding_dimensions: int
+    # Embed in-process with a sentence-transformer (e.g. intfloat/multilingual-e5-small)
+    local_embedding_model: str | None = None
     
-    chunk_size: int = 500
-    chunk_overlap: int = 50
+    openai_concurrency: int = 16
+    max_concurrency: int = 8
+    llm_cache_path: str | None = ".rag_llm_cache.db"
+    embedding_cache_path: str | None = None
+    embedding_memory_cache_size: int = 4096
+    
+    chunk_size: int = 800
+    chunk_overlap: int = 160
+    chunk_labeling: bool = True
+    summary_max_input_tokens: int = 24000
+    response_max_prompt_tokens: int = 12000
 
     mongodb_uri: str
     mongodb_db_name: str
@@ -19,9 +30,16 @@ class Settings(BaseSettings):
     mongodb_summary_collection: str = "compiled-answers-test-summary"
     mongodb_chunks_collection: str = "compiled-answers-test-chunks"
 
-    class Config:
-        env_file = ".env"
-        case_sensitive = False
+    redis_url: str | None = None
+
+    # Level for every package logger; DEBUG also sends per-result search details to the log file
+    log_level: str = "INFO"
+
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        case_sensitive=False,
+        frozen=True
+    )
 
 @lru_cache()
 def get_settings() -> Settings:
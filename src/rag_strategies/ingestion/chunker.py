@@ -1,16 +1,37 @@
 from typing import List, Dict
-from rag_strategies import get_llm, get_embeddings_model
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from rag_strategies import get_llm, get_embeddings_model, get_openai_semaphore, settings
 from rag_strategies.utils.logger import setup_logger
-import json
+import json_repair
 import re
 
 logger = setup_logger(__name__)
 
+_CODE_FENCE_RE = re.compile(r'^```(?:json)?\s*\n?|\n?```\s*$', re.M)
+
+# Static instructions first and chunk text last, so providers can cache the shared prefix
+_LABEL_PROMPT_PREFIX = """
+Label each numbered chunk below.
+
+Return one JSON object per line (NDJSON), one line per chunk, in this exact shape:
+{"id": 0, "type": "procedure|definition|overview|policy|general", "key_concepts": ["main topics"], "relationships": ["related concepts"], "is_procedure": true|false, "procedure_type": "string if applicable, null if not", "is_complete_procedure": true|false}
+
+Return ONLY the JSON lines - no array, no markdown, no commentary.
+
+Chunks:
+"""
+
 class SemanticChunker:
     def __init__(self, llm=None, embeddings=None):
         """Initialize the chunker with LLM and embeddings models"""
         self.llm = llm or get_llm()
         self.embeddings = embeddings or get_embeddings_model()
+        # Paragraph-first boundaries; the LLM only labels the resulting chunks
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=settings.chunk_size,
+            chunk_overlap=settings.chunk_overlap,
+            separators=["\n\n", "\n", ". ", " ", ""]
+        )
 
     async def create_semantic_chunks(self, text: str, document_info: Dict) -> List[Dict]:
         """Create chunks with semantic understanding"""
@@ -18,18 +39,19 @@ class SemanticChunker:
             # Create chunks
             chunks = await self._create_chunks(text)
             
+            # Embed all chunks of the document in one batched request
+            embeddings = await self._create_contextual_embeddings(
+                [chunk['content'] for chunk in chunks],
+                document_info
+            )
+            root_id = document_info['component_path'].split('_')[0]
+
             # Enhance chunks with embeddings and metadata
             enhanced_chunks = []
-            for chunk in chunks:
-                embedding = await self._create_contextual_embedding(
-                    chunk['content'],
-                    document_info
-                )
-                root_id = document_info['component_path'].split('_')[0]
-                
+            for chunk, embedding in zip(chunks, embeddings):
                 metadata = {
                     'component_path': document_info['component_path'],
-                    'business_areas': document_info.get('business_areas', []) or [],
+                    'business_areas': document_info.get('business_areas', []),
                     'products': document_info.get('products', []),
                     'content_type': document_info.get('content_type', 'general'),
                     'applies_to_all_business_areas': document_info.get('applies_to_all_business_areas', False),
@@ -56,241 +78,87 @@ class SemanticChunker:
             raise
 
     async def _create_chunks(self, text: str) -> List[Dict]:
-        """Create semantic chunks with metadata"""
-        prompt = f"""
-        Create semantic chunks from this content following these guidelines:
-
-        1. Content Organization:
-        - Keep ALL steps of a procedure together in one chunk
-        - Keep definitions with their complete explanations
-        - Keep strongly related content together
-        - Maintain context within each chunk
-        - For procedures, include all related steps in the same chunk
-        - For definitions, include the complete definition with any related context
-
-        2. Chunk Properties:
-        - Each chunk must be self-contained and meaningful
-        - Include necessary context within each chunk
-        - Preserve important cross-references
-        - Keep chunk size reasonable (200-1000 characters optimal)
-
-        3. CRITICAL - JSON Format Requirements:
-        - IMPORTANT: Only use backslashes for JSON escaping (\", \\n) - no other backslashes allowed
-        - MOST IMPORTANT: DO NOT escape parentheses () in content text
-            - Example CORRECT: "monthly bonus (if applicable)"
-            - Example INCORRECT: "monthly bonus $if applicable$"
-        - Return ONLY strictly valid JSON chunks
-        - Each chunk must be a complete, valid JSON object
-        - Properly escape all special characters in JSON strings
-        - Use \\n for line breaks in content
-        - Do not include any unescaped quotes or special characters
-        - Separate chunks with ###
-        - Use plain text only - do not include any markdown formatting
-        - Never leave properties unquoted
-        - Format each chunk EXACTLY as shown:
-        {{
-            "content": "properly escaped text content",
-            "chunk_metadata": {{
-                "type": "procedure|definition|overview|general",
-                "key_concepts": ["main topics"],
-                "relationships": ["related concepts"]
-            }},
-            "is_procedure": true|false,
-            "procedure_type": "string if applicable, null if not",
-            "is_complete_procedure": true|false
-        }}
-        - ABSOLUTELY NO DEVIATIONS from this JSON structure are allowed.
-        - ALWAYS verify JSON structure is complete and balanced before returning
-
-        4. Examples of properly formatted chunks:
-
-        Example 1 - Basic Documentation:
-        {{
-            "content": "Commission Calculation Guidelines:\\n\\nBasic Rate: 5% of total sale\\nMinimum Commission: $100\\n\\nAdjustments:\\n1. Senior Agents: +2%\\n2. Special Programs: +1%\\n3. Training Period: -1%",
-            "chunk_metadata": {{
-                "type": "procedure",
-                "key_concepts": ["commission calculation", "rates"],
-                "relationships": ["sales", "compensation"]
-            }},
-            "is_procedure": true,
-            "procedure_type": "calculation",
-            "is_complete_procedure": true
-        }}
-
-        Example 2 - Policy Information:
-        {{
-            "content": "Commission Policy Updates for 2024:\\n\\nStandard Commission Structure:\\n- Base Rate: 5%\\n- Volume Bonus: Up to 2%\\n- Referral Bonus: 1%\\n\\nFor complete details, see the Commission Policy Guide.",
-            "chunk_metadata": {{
-                "type": "policy",
-                "key_concepts": ["commission rates", "policy updates"],
-                "relationships": ["compensation"]
-            }},
-            "is_procedure": false,
-            "procedure_type": null,
-            "is_complete_procedure": false
-        }}
-
-        Example 3 - Special Cases:
-        {{
-            "content": "FHA COVID-19 Impact Guidelines:\\n\\nFor clients affected by COVID-19:\\n1. Review standard qualification criteria\\n2. Document COVID-19 impact\\n3. Apply special consideration factors\\n\\nRefer to full COVID-19 Policy Guide for details.",
-            "chunk_metadata": {{
-                "type": "procedure",
-                "key_concepts": ["FHA", "COVID-19", "qualification"],
-                "relationships": ["guidelines", "special consideration"]
-            }},
-            "is_procedure": true,
-            "procedure_type": "qualification",
-            "is_complete_procedure": true
-        }}
-
-        CRITICAL FORMATTING RULES:
-        1. Ensure that all parentheses () are properly balanced and escaped
-        2. Convert any HTML or markdown to plain text
-        3. Replace links with descriptive text
-        4. Remove any special formatting or symbols
-        5. Keep content clear and readable
-        6. Use proper line breaks (\\n) for formatting
-        7. Escape all special characters properly
-        8. Remove any raw URLs or IDs
-        9. Keep content structure simple and consistent
-        10. Maintain proper JSON formatting throughout
-        11. Always properly escape dollar signs with a backslash
-        12. Never use unescaped backslashes except in valid escape sequences
-        13. Ensure all JSON strings are properly quoted and escaped
-        14. Remove any HTML entities or special characters
-        15. Use only ASCII characters in the output
-        16. CRITICAL - For parentheses in content:  
-            - Write normal parentheses () directly in the text
-            - DO NOT escape normal parentheses
-            - Example CORRECT: "Monthly report (includes tax details)"
-            - Example INCORRECT: "Monthly report $includes tax details$"
-            - Only escape characters that must be escaped in JSON strings (\", \\, \n)
-
-        Example of correct parentheses handling:
-        {{
-            "content": "Income Calculation Steps:\\n\\n1. Review past records (minimum 2 years)\\n2. Calculate average (excluding outliers)\\n3. Apply adjustment factor \(if required\)",
-            "chunk_metadata": {{
-                "type": "procedure",
-                "key_concepts": ["income calculation"],
-                "relationships": ["financial review"]
-            }},
-            "is_procedure": true,
-            "procedure_type": "calculation",
-            "is_complete_procedure": true
-        }}
-
-        Content to chunk:
-        {text}
-        """
-
-        response = await self.llm.ainvoke(prompt)
+        """Split content deterministically, then label the chunks with one LLM call"""
+        contents = self.splitter.split_text(text)
+        if not contents:
+            logger.error("No chunks produced from content")
+            raise ValueError("No chunks produced from content")
+
+        labels = await self._label_chunks(contents) if settings.chunk_labeling else {}
+
+        chunks = []
+        for i, content in enumerate(contents):
+            label = labels.get(i, {})
+            chunks.append({
+                'content': content,
+                'chunk_metadata': {
+                    'type': label.get('type') or 'general',
+                    'key_concepts': label.get('key_concepts') or [],
+                    'relationships': label.get('relationships') or []
+                },
+                'is_procedure': bool(label.get('is_procedure', False)),
+                'procedure_type': label.get('procedure_type'),
+                'is_complete_procedure': bool(label.get('is_complete_procedure', False))
+            })
+
+        logger.info(f"Successfully created {len(chunks)} chunks")
+        return chunks
+
+    async def _label_chunks(self, contents: List[str]) -> Dict[int, Dict]:
+        """Classify every chunk of a document in a single LLM request"""
+        numbered = "\n\n".join(f"[{i}]\n{content}" for i, content in enumerate(contents))
+        prompt = _LABEL_PROMPT_PREFIX + numbered
+
+        async with get_openai_semaphore():
+            response = await self.llm.ainvoke(prompt)
         if not response.content.strip():
-            logger.error("Empty response from LLM")
-            raise ValueError("Empty response from LLM")
-
-        return self._parse_chunks(response.content)
-
-    def _parse_chunks(self, llm_response: str) -> List[Dict]:
-        """Parse LLM response into chunks with metadata"""
-        try:
-            # Clean and validate response
-            clean_response = llm_response.replace('```json', '').replace('```', '').strip()
-            raw_chunks = [chunk.strip() for chunk in clean_response.split('###') if chunk.strip()]
-            
-            if not raw_chunks:
-                logger.error("No chunks found in LLM response")
-                raise ValueError("No chunks found in LLM response")
-            
-            chunks = []
-            for i, raw_chunk in enumerate(raw_chunks):
-                try:
-                    # First attempt: try direct JSON parsing
-                    logger.debug(f"Character at position 31: '{raw_chunk[31]}'")
-                    logger.debug(f"Characters around position 31: '{raw_chunk[25:35]}'")
-                    try:
-                        chunk_data = json.loads(raw_chunk)
-                    except json.JSONDecodeError:
-                        # Second attempt: clean the chunk and try again
-                        cleaned_chunk = raw_chunk.replace('\n', ' ')
-                        cleaned_chunk = re.sub(r'\$?!["\\/bfnrt]|u[0-9a-fA-F]{4})', '', cleaned_chunk)
-                        
-                        try:
-                            chunk_data = json.loads(cleaned_chunk)
-                        except json.JSONDecodeError:
-                            # If both attempts fail, create a basic chunk structure
-                            # Safely extract content using string operations instead of regex
-                            content_start = cleaned_chunk.find('"content":"') + 11
-                            content_end = cleaned_chunk.find('","chunk_metadata"', content_start)
-                            if content_start > 10 and content_end > content_start:
-                                content = cleaned_chunk[content_start:content_end]
-                            else:
-                                content = "Error: Could not parse content"
-
-                            # Create a basic chunk structure
-                            chunk_data = {
-                                "content": content,
-                                "chunk_metadata": {
-                                    "type": "general",
-                                    "key_concepts": [],
-                                    "relationships": []
-                                },
-                                "is_procedure": False,
-                                "procedure_type": None,
-                                "is_complete_procedure": False
-                            }
-                    
-                    # Validate required fields
-                    if not all(k in chunk_data for k in ['content', 'chunk_metadata']):
-                        logger.error(f"Chunk {i + 1} missing required fields")
-                        raise ValueError(f"Chunk {i + 1} format invalid: missing required fields")
-                    
-                    # Clean up the content field
-                    if isinstance(chunk_data['content'], str):
-                        chunk_data['content'] = chunk_data['content'].replace('\\n', '\n')
-                    
-                    chunks.append(chunk_data)
-                    
-                except Exception as e:
-                    logger.error(f"Failed to parse chunk {i + 1}: {str(e)}")
-                    logger.error(f"Problematic chunk: {raw_chunk[:200]}...")
-                    logger.debug(f"Full problematic chunk: {raw_chunk}")
-                    raise
-            
-            logger.info(f"Successfully created {len(chunks)} chunks")
-            return chunks
-                
-        except Exception as e:
-            logger.error(f"Error in _parse_chunks: {str(e)}")
-            raise
+            logger.warning("Empty labeling response from LLM, using default labels")
+            return {}
+
+        return self._parse_labels(response.content)
+
+    def _parse_labels(self, llm_response: str) -> Dict[int, Dict]:
+        """Parse NDJSON chunk labels keyed by chunk id, skipping malformed lines"""
+        clean_response = _CODE_FENCE_RE.sub('', llm_response).strip()
+
+        labels = {}
+        for line in clean_response.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            # json_repair tolerates the stray escapes and quotes LLMs emit
+            label = json_repair.loads(line)
+            if not isinstance(label, dict) or not isinstance(label.get('id'), int):
+                logger.warning(f"Skipping malformed chunk label: {line[:200]}")
+                continue
+            labels[label['id']] = label
+
+        return labels
     
-    async def _create_contextual_embedding(self, content: str, document_info: Dict) -> List[float]:
-        """Create embedding with document context"""
+    async def _create_contextual_embeddings(self, contents: List[str], document_info: Dict) -> List[List[float]]:
+        """Create embeddings with document context for all chunks of a document"""
         try:
-            # Handle None values for document info fields
+            # List fields are normalized by the processor when documents are read
             business_areas = document_info.get('business_areas', [])
-            if business_areas is None:
-                business_areas = []
-                
             products = document_info.get('products', [])
-            if products is None:
-                products = []
-                
-            tags = document_info.get('tags', [])
-            if tags is None:
-                tags = []
 
-            context = f"""
+            # Context prefix is identical for every chunk of the document
+            prefix = f"""
             Document: {document_info.get('page_title', '')}
             Content Type: {document_info.get('content_type', 'general')}
             Business Areas: {', '.join(business_areas)}
             Products: {', '.join(products)}
-            
+            """
+            contexts = [
+                f"""{prefix}
             Content: {content}
             """
+                for content in contents
+            ]
             
-            return await self.embeddings.embed_query(context)
+            return await self.embeddings.embed_documents(contexts)
             
         except Exception as e:
-            logger.error(f"Error creating contextual embedding: {str(e)}")
+            logger.error(f"Error creating contextual embeddings: {str(e)}")
             logger.error(f"Document info: {document_info}")
             raise
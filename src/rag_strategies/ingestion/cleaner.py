@@ -4,6 +4,12 @@ from rag_strategies.utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Space runs and 3+ newlines are collapsed in a single pass
+_WHITESPACE_RUNS_RE = re.compile(r' {2,}|\n{3,}')
+
+def _collapse_whitespace_run(match: re.Match) -> str:
+    return ' ' if match.group()[0] == ' ' else '\n\n'
+
 class ContentCleaner:
     def clean_content(self, content: str) -> str:
         """Clean content by removing HTML tags and normalizing text"""
@@ -23,7 +29,8 @@ class ContentCleaner:
     def _remove_html_safely(self, content: str) -> str:
         """Remove HTML while preserving text"""
         try:
-            soup = BeautifulSoup(content, 'html.parser')
+            # lxml is a C parser; _fallback_cleaning keeps the pure-Python html.parser
+            soup = BeautifulSoup(content, 'lxml')
             text = soup.get_text(separator='\n')
             return text
             
@@ -37,11 +44,8 @@ class ContentCleaner:
             # Normalize line endings
             text = text.replace('\r\n', '\n')
             
-            # Remove extra spaces
-            text = re.sub(r' +', ' ', text)
-            
-            # Normalize multiple newlines
-            text = re.sub(r'\n{3,}', '\n\n', text)
+            # Remove extra spaces and normalize multiple newlines
+            text = _WHITESPACE_RUNS_RE.sub(_collapse_whitespace_run, text)
             
             return text.strip()
             
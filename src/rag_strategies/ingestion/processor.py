@@ -1,17 +1,40 @@
-from datetime import datetime
-from typing import List, Dict
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from typing import List, Dict, Optional, AsyncIterator
 from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
 from rag_strategies.ingestion.cleaner import ContentCleaner
 from rag_strategies.ingestion.chunker import SemanticChunker
-from rag_strategies import get_embeddings_model, get_llm, setup_logger, settings
+from rag_strategies import get_embeddings_model, get_llm, get_openai_semaphore, setup_logger, settings
 
 logger = setup_logger(__name__)
 
+# Source fields that downstream code joins/iterates as lists
+_LIST_FIELDS = ("BusinessAreas", "Channels", "Subjects", "Tags")
+
+# Static instructions first and content last, so providers can cache the shared prefix
+_SUMMARY_PROMPT_PREFIX = """
+Create a comprehensive summary of these related documents following these guidelines:
+1. Begin with a clear overview
+2. Identify main topics and key concepts
+3. Highlight important relationships between documents
+4. Include key steps or procedures if present
+5. Note any important definitions or terms
+6. Maintain context and relationships
+7. Structure the summary with clear sections
+8. Provide a well-structured summary that captures the main points and relationships
+
+Content:
+"""
+
 class DocumentProcessor:    
-    async def __ainit__(self):
-        """Async initialization"""
-        self.client = AsyncIOMotorClient(settings.mongodb_uri)
+    async def __ainit__(self, client: Optional[AsyncIOMotorClient] = None):
+        """Async initialization, optionally sharing an existing Motor client"""
+        self._owns_client = client is None
+        self.client = client or AsyncIOMotorClient(settings.mongodb_uri)
         self.db = self.client[settings.mongodb_db_name]
         self.docs_collection = self.db[settings.mongodb_collection_name]
         self.summary_collection = self.db[settings.mongodb_summary_collection]
@@ -21,20 +44,22 @@ class DocumentProcessor:
         self.embeddings = get_embeddings_model()
         self.llm = get_llm()
         self.cleaner = ContentCleaner()
+        # Bounds how many documents of a root_id are chunked at once
+        self._document_semaphore = asyncio.Semaphore(settings.max_concurrency)
         
         return self
     
     @classmethod
-    async def create(cls):
+    async def create(cls, client: Optional[AsyncIOMotorClient] = None):
         """Factory method to create instance"""
         self = cls()
-        await self.__ainit__()
+        await self.__ainit__(client)
         return self
 
     async def cleanup(self): 
-        """Cleanup resources"""
+        """Cleanup resources (a shared client is closed by its owner)"""
         try:
-            if self.client:
+            if self.client and self._owns_client:
                 self.client.close()
         except Exception as e:
             logger.error(f"Error during cleanup: {str(e)}")
@@ -44,32 +69,96 @@ class DocumentProcessor:
         try:
             stats = {
                 "total_documents": 0,
+                "unchanged_documents": 0,
                 "total_chunks": 0,
                 "chunks_by_type": {},
                 "average_chunk_size": 0,
-                "processing_start": datetime.utcnow()
+                "processing_start": datetime.now(timezone.utc)
             }
 
-            # Get all related documents
-            related_docs = await self._get_related_documents(root_id)
+            # Stream related documents, cleaning each off the event loop as it arrives
+            related_docs = []
+            cleaning_tasks = []
+            async for doc in self._get_related_documents(root_id):
+                related_docs.append(doc)
+                cleaning_tasks.append(asyncio.create_task(
+                    asyncio.to_thread(self.cleaner.clean_content, doc['Content'])
+                ))
+
             if not related_docs:
                 logger.warning(f"No documents found for root_id: {root_id}")
+                # The root's source documents were removed; stop serving its content
+                await self._delete_root_content(root_id)
                 return
 
             stats["total_documents"] = len(related_docs)
 
-            # Clean all documents content
-            for doc in related_docs:
-                doc['Content'] = self.cleaner.clean_content(doc['Content'])
+            cleaned_contents = await asyncio.gather(*cleaning_tasks)
+            for doc, cleaned in zip(related_docs, cleaned_contents):
+                doc['Content'] = cleaned
+                doc['content_hash'] = self._document_hash(doc)
+            current_hashes = [doc['content_hash'] for doc in related_docs]
+            root_hash = hashlib.sha256("".join(current_hashes).encode()).hexdigest()
+
+            # Reuse the stored summary when no document changed since the last ingest
+            existing_summary = await self.summary_collection.find_one(
+                {"root_id": root_id, "content_hash": root_hash},
+                {"_id": 1}
+            )
+            if existing_summary:
+                summary_id = existing_summary["_id"]
+            else:
+                summary_doc = await self._create_summary(related_docs)
+                summary_doc["content_hash"] = root_hash
+                await self.summary_collection.delete_many({"root_id": root_id})
+                summary_id = await self._store_summary(summary_doc)
+                await self.chunks_collection.update_many(
+                    {"root_id": root_id},
+                    {"$set": {"summary_id": summary_id}}
+                )
 
-            # Create summary
-            summary_doc = await self._create_summary(related_docs)
-            summary_id = await self._store_summary(summary_doc)
+            # Drop chunks of documents that changed or no longer exist, and only
+            # chunk documents whose current content has not been stored yet
+            await self.chunks_collection.delete_many(
+                {"root_id": root_id, "content_hash": {"$nin": current_hashes}}
+            )
+            stored_hashes = set(await self.chunks_collection.distinct(
+                "content_hash",
+                {"root_id": root_id}
+            ))
+            changed_docs = [doc for doc in related_docs if doc['content_hash'] not in stored_hashes]
+            stats["unchanged_documents"] = len(related_docs) - len(changed_docs)
             
-            # Process each document for chunks
+            # Process documents for chunks concurrently
+            async def process_bounded(doc: Dict):
+                async with self._document_semaphore:
+                    return await self._process_document(doc, summary_id)
+
+            results = await asyncio.gather(
+                *[process_bounded(doc) for doc in changed_docs],
+                return_exceptions=True
+            )
+            errors = [r for r in results if isinstance(r, Exception)]
+            if errors:
+                raise errors[0]
+
+            # Store every document's chunks in one unordered bulk insert
+            all_chunks = [chunk for chunks in results for chunk in chunks]
+            if all_chunks:
+                try:
+                    await self.chunks_collection.insert_many(all_chunks, ordered=False)
+                except Exception:
+                    # A partial insert would look complete to the stored-hash check,
+                    # so drop the changed documents' chunks to re-chunk them next run
+                    await self.chunks_collection.delete_many({
+                        "root_id": root_id,
+                        "content_hash": {"$in": [doc['content_hash'] for doc in changed_docs]}
+                    })
+                    raise
+                logger.info(f"Stored {len(all_chunks)} chunks for root_id: {root_id}")
+
             chunk_sizes = []
-            for doc in related_docs:
-                chunks = await self._process_document(doc, summary_id)
+            for chunks in results:
                 if chunks:  # Only process if chunks were returned
                     stats["total_chunks"] += len(chunks)
                     chunk_sizes.extend([len(c['content']) for c in chunks])
@@ -83,7 +172,7 @@ class DocumentProcessor:
             if chunk_sizes:
                 stats["average_chunk_size"] = sum(chunk_sizes) / len(chunk_sizes)
             
-            stats["processing_end"] = datetime.utcnow()
+            stats["processing_end"] = datetime.now(timezone.utc)
             stats["processing_time"] = (stats["processing_end"] - stats["processing_start"]).total_seconds()
 
             logger.info(f"Successfully processed root_id: {root_id}")
@@ -93,10 +182,11 @@ class DocumentProcessor:
             logger.error(f"Error processing root_id {root_id}: {str(e)}")
             raise
 
-    async def _get_related_documents(self, root_id: str) -> List[Dict]:
+    async def _get_related_documents(self, root_id: str) -> AsyncIterator[Dict]:
         """Get all documents related to root_id with specific field exclusions"""
+        # Prefix match as an index range scan: "`" is the character after "_"
         query = {
-            "ComponentPath": {"$regex": f"^{root_id}_.*"}
+            "ComponentPath": {"$gte": f"{root_id}_", "$lt": f"{root_id}`"}
         }
         projection = {
             "ContentEmbeddings": 0,
@@ -104,38 +194,29 @@ class DocumentProcessor:
             "EmbeddingsChunkId": 0
         }
         
-        return await self.docs_collection.find(
+        cursor = self.docs_collection.find(
             query,
             projection
-        ).sort("ComponentPath", 1).to_list(None)
+        ).sort("ComponentPath", 1).batch_size(100)
+        async for doc in cursor:
+            yield self._normalize_doc(doc)
+
+    def _normalize_doc(self, document: Dict) -> Dict:
+        """Coerce list-typed fields once at read time (None -> [], scalar -> [str])"""
+        for field in _LIST_FIELDS:
+            value = document.get(field)
+            if value is None:
+                document[field] = []
+            elif not isinstance(value, list):
+                document[field] = list(value) if isinstance(value, tuple) else [str(value)]
+        return document
 
     async def _create_summary(self, documents: List[Dict]) -> Dict:
         """Create summary using all documents content"""
         try:
             logger.info(f"Creating summary for {len(documents)} documents")
             
-            # Combine all documents content
-            combined_content = "\n\n".join(doc["Content"] for doc in documents)
-            
-            prompt = f"""
-            Create a comprehensive summary of these related documents following these guidelines:
-            1. Begin with a clear overview
-            2. Identify main topics and key concepts
-            3. Highlight important relationships between documents
-            4. Include key steps or procedures if present
-            5. Note any important definitions or terms
-            6. Maintain context and relationships
-            7. Structure the summary with clear sections
-
-            Content:
-            {combined_content}
-
-            Provide a well-structured summary that captures the main points and relationships.
-            """
-
-            logger.debug("Sending summary request to LLM")
-            response = await self.llm.ainvoke(prompt)
-            summary = response.content
+            summary = await self._summarize_contents([doc["Content"] for doc in documents])
             
             logger.debug(f"Summary generated: {len(summary)} characters")
             
@@ -143,7 +224,7 @@ class DocumentProcessor:
             summary_embedding = await self._create_summary_embedding(summary, documents[0])
             
             main_doc = documents[0]
-            business_areas = main_doc.get("BusinessAreas", []) 
+            business_areas = main_doc["BusinessAreas"]
             
             summary_doc = {
                 "root_id": self._extract_root_id(main_doc["ComponentPath"]),
@@ -159,15 +240,15 @@ class DocumentProcessor:
                     for doc in documents
                 ],
                 "metadata": {
-                    "channels": main_doc.get("Channels", []),
+                    "channels": main_doc["Channels"],
                     "business_areas": business_areas,
                     "applies_to_all_business_areas": not business_areas or business_areas == [""],
-                    "subjects": main_doc.get("Subjects", []),
-                    "tags": main_doc.get("Tags", []),
+                    "subjects": main_doc["Subjects"],
+                    "tags": main_doc["Tags"],
                     "document_count": len(documents),
-                    "created_at": datetime.utcnow()
+                    "created_at": datetime.now(timezone.utc)
                 },
-                "last_updated": datetime.utcnow()
+                "last_updated": datetime.now(timezone.utc)
             }
 
             logger.debug(f"Summary document created with {len(summary_doc['source_documents'])} sources")
@@ -177,19 +258,68 @@ class DocumentProcessor:
             logger.error(f"Error creating summary: {str(e)}")
             raise
 
-    async def _process_document(self, document: Dict, summary_id: ObjectId):
-        """Process individual document into chunks"""
+    async def _summarize_contents(self, contents: List[str]) -> str:
+        """Summarize contents in one call, or map-reduce halves that exceed the token budget"""
+        # Tokenizing is CPU-bound, so each text is counted once, off the event loop
+        counts = await asyncio.to_thread(self._count_tokens, [_SUMMARY_PROMPT_PREFIX, *contents])
+        budget = settings.summary_max_input_tokens - counts[0]
+        return await self._summarize_counted(contents, counts[1:], budget)
+
+    async def _summarize_counted(self, contents: List[str], counts: List[int], budget: int) -> str:
+        """Summarize contents whose token counts are already known"""
+        num_tokens = self._joined_tokens(counts)
+        if num_tokens <= budget or len(contents) == 1:
+            return await self._invoke_summary(self._fit_to_budget(contents, counts, budget))
+
+        logger.debug(f"Map-reducing summary of {len(contents)} parts ({num_tokens} tokens)")
+        mid = len(contents) // 2
+        partial_summaries = list(await asyncio.gather(
+            self._summarize_counted(contents[:mid], counts[:mid], budget),
+            self._summarize_counted(contents[mid:], counts[mid:], budget)
+        ))
+        # The two partial summaries are combined in one final call, truncated if
+        # still too long, rather than reduced again
+        partial_counts = await asyncio.to_thread(self._count_tokens, partial_summaries)
+        return await self._invoke_summary(self._fit_to_budget(partial_summaries, partial_counts, budget))
+
+    def _count_tokens(self, texts: List[str]) -> List[int]:
+        """Token count of each text (blocking)"""
+        return [self.llm.get_num_tokens(text) for text in texts]
+
+    def _joined_tokens(self, counts: List[int]) -> int:
+        """Token count of texts joined by blank lines, each separator counted as one token"""
+        return sum(counts) + len(counts) - 1
+
+    def _fit_to_budget(self, contents: List[str], counts: List[int], budget: int) -> str:
+        """Join contents, cutting each one proportionally when the total exceeds the budget"""
+        num_tokens = self._joined_tokens(counts)
+        if num_tokens > budget:
+            ratio = budget / num_tokens
+            contents = [content[:int(len(content) * ratio)] for content in contents]
+        return "\n\n".join(contents)
+
+    async def _invoke_summary(self, content: str) -> str:
+        """Send a single summary request to the LLM"""
+        prompt = _SUMMARY_PROMPT_PREFIX + content
+
+        logger.debug("Sending summary request to LLM")
+        async with get_openai_semaphore():
+            response = await self.llm.ainvoke(prompt)
+        return response.content
+
+    async def _process_document(self, document: Dict, summary_id: ObjectId) -> List[Dict]:
+        """Process individual document into chunks (stored by the caller)"""
         try:
             logger.info(f"Processing document: {document['ComponentPath']}")
-            business_areas = document.get("BusinessAreas", [])
+            business_areas = document["BusinessAreas"]
             doc_info = {
                 "component_path": document["ComponentPath"],
                 "page_title": document["PageTitle"],
-                "channels": document.get("Channels", []),
+                "channels": document["Channels"],
                 "business_areas": business_areas,
                 "applies_to_all_business_areas": not business_areas or business_areas == [""],
-                "subjects": document.get("Subjects", []),
-                "tags": document.get("Tags", [])
+                "subjects": document["Subjects"],
+                "tags": document["Tags"]
             }
 
             logger.debug(f"Document info prepared: {doc_info}")
@@ -200,20 +330,25 @@ class DocumentProcessor:
                 doc_info
             )
 
-            logger.debug(f"Created {len(chunks)} chunks")
-            logger.debug("Chunk types distribution: " + 
-                        str({chunk['metadata']['chunk_analysis']['type']: 1 
-                            for chunk in chunks}))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Created %d chunks", len(chunks))
+                logger.debug(
+                    "Chunk types distribution: %s",
+                    {chunk['metadata']['chunk_analysis']['type']: 1 for chunk in chunks}
+                )
 
-            # Add summary_id to each chunk
+            # Add summary_id and source content hash to each chunk
             for chunk in chunks:
                 chunk["summary_id"] = summary_id
+                chunk["content_hash"] = document["content_hash"]
 
-            # Store chunks
             if chunks:
-                await self.chunks_collection.insert_many(chunks)
-                logger.info(f"Stored {len(chunks)} chunks for {document['ComponentPath']}")
-                logger.debug(f"Average chunk size: {sum(len(c['content']) for c in chunks)/len(chunks):.0f} characters")
+                logger.info(f"Created {len(chunks)} chunks for {document['ComponentPath']}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "Average chunk size: %.0f characters",
+                        sum(len(c['content']) for c in chunks) / len(chunks)
+                    )
                 return chunks
             else:
                 logger.warning(f"No chunks created for document {document['ComponentPath']}")
@@ -226,30 +361,44 @@ class DocumentProcessor:
     async def _create_summary_embedding(self, summary_text: str, document: Dict) -> List[float]:
         """Create summary embedding with enhanced context"""
         try:
-            business_areas = document.get('BusinessAreas', [])
-            if business_areas is None:
-                business_areas = []
-            elif not isinstance(business_areas, (list, tuple)):
-                business_areas = [str(business_areas)]
-                
             context = f"""
             Document Title: {document.get('PageTitle', '')}
-            Business Areas: {', '.join(business_areas)}
-            Channels: {', '.join(document.get('Channels', []))}
+            Business Areas: {', '.join(document['BusinessAreas'])}
+            Channels: {', '.join(document['Channels'])}
             
             Summary Content:
             {summary_text}
             """
             
             logger.debug(f"Created context with length: {len(context)}")
-            return await self.embeddings.embed_query(context)
+            return await self.embeddings.embed_query_batched(context)
             
         except Exception as e:
             logger.error(f"Error creating summary embedding: {str(e)}")
-            logger.error(f"BusinessAreas value: {document.get('BusinessAreas')}")
-            logger.error(f"BusinessAreas type: {type(document.get('BusinessAreas'))}")
             raise
 
+    def _document_hash(self, document: Dict) -> str:
+        """Hash a document's cleaned content and the metadata stored/embedded with its chunks"""
+        return hashlib.sha256(json.dumps(
+            [
+                document['ComponentPath'],
+                document.get('PageTitle'),
+                document['BusinessAreas'],
+                document['Channels'],
+                document['Subjects'],
+                document['Tags'],
+                document['Content']
+            ],
+            default=str
+        ).encode()).hexdigest()
+
+    async def _delete_root_content(self, root_id: str):
+        """Remove the chunks and summary stored for a root_id"""
+        await asyncio.gather(
+            self.chunks_collection.delete_many({"root_id": root_id}),
+            self.summary_collection.delete_many({"root_id": root_id})
+        )
+
     def _extract_root_id(self, component_path: str) -> str:
         """Extract root_id from component path"""
         return component_path.split('_')[0]
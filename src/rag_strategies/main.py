@@ -1,21 +1,46 @@
+import asyncio
 import re
+import json
 import random
 import uuid
+from collections import OrderedDict
 
 from fastapi import FastAPI, HTTPException, Depends
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field, validator
-from typing import List, Optional, Dict
-from datetime import datetime
+from typing import AsyncIterator, Callable, List, Optional, Dict
 from enum import Enum
 
 # from rag_strategies.ingestion.processor import DocumentProcessor
+from rag_strategies.config import settings
 from rag_strategies.retrieval.rag_system import RAGSystem
 from rag_strategies.utils.logger import setup_logger
+from rag_strategies.utils.openai_client import close_openai_client
+from rag_strategies.utils.semantic_cache import SemanticCache
 from rag_strategies.utils.ssl_utils import setup_ssl_certificates
+from rag_strategies.utils.time_utils import utc_timestamp
 
 logger = setup_logger(__name__)
 
+_GREETING_RE = re.compile(
+    r"^\s*(?:(?:hi|hello|hey)(?:\s+(?:there|everyone|all))?"
+    r"|greetings|good morning|good afternoon|good evening)\s*$",
+    re.IGNORECASE
+)
+_POLICY_KEYWORDS = (
+    'policy', 'requirement', 'procedure', 'pace', 'lien',
+    'modification', 'short sale', 'deed', 'loan', 'mortgage',
+    'guidelines', 'rules', 'process'
+)
+# One pass over the message for any keyword; substring match, so e.g. "loans"
+# and "processing" count as policy questions
+_POLICY_KEYWORDS_RE = re.compile(
+    "|".join(re.escape(keyword) for keyword in sorted(_POLICY_KEYWORDS, key=len, reverse=True)),
+    re.IGNORECASE
+)
+
 class MessageType(Enum):
     GREETING = "greeting"
     POLICY = "policy"
@@ -47,9 +72,21 @@ class MessageResponse(BaseModel):
     metadata: Optional[Dict] = None
 
 class ConversationManager:
-    def __init__(self):
-        self.conversations = {}
-        self.rag_system = RAGSystem()
+    def __init__(self, rag_system: RAGSystem):
+        # LRU of conversation histories, capped so idle sessions are evicted
+        self.conversations: OrderedDict[str, List[Dict]] = OrderedDict()
+        self.max_conversations = 10_000
+        # With REDIS_URL set, history is shared across workers and expires after history_ttl
+        self.redis = None
+        self.history_ttl = 3600
+        if settings.redis_url:
+            # Optional dependency: pip install rag_strategies[redis]
+            import redis.asyncio as redis
+            self.redis = redis.from_url(settings.redis_url, decode_responses=True)
+        self.rag_system = rag_system
+        self.embeddings = rag_system.query_processor.embeddings
+        # Paraphrased policy questions reuse a prior answer, per channel
+        self.response_caches: Dict[str, SemanticCache] = {}
         self.max_history = 10
         self.greeting_responses = [
             "Hello! How can I help you with policy questions today?",
@@ -62,21 +99,34 @@ class ConversationManager:
             "Please ask me about specific policies or procedures."
         ]
 
-    async def process_message(self, request: MessageRequest) -> MessageResponse:
+    async def process_message(
+        self,
+        request: MessageRequest,
+        on_delta: Optional[Callable[[str], None]] = None
+    ) -> MessageResponse:
         """Process incoming message and generate response"""
         conversation_id = request.conversation_id or str(uuid.uuid4())
-        history = self.conversations.get(conversation_id, [])
+        # One timestamp for every field this request stamps
+        timestamp = utc_timestamp()
 
         try:
+            history = await self._get_history(conversation_id)
             message_type = await self._determine_message_type(request.message)
+            if message_type == MessageType.POLICY and not request.channel:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Channel is required for policy queries"
+                )
             
             response = await self._handle_message(
                 message_type=message_type,
                 request=request,
-                history=history
+                history=history,
+                timestamp=timestamp,
+                on_delta=on_delta
             )
 
-            self._update_history(conversation_id, request.message, response)
+            await self._update_history(conversation_id, request.message, response, timestamp)
 
             return MessageResponse(
                 response=response["answer"],
@@ -87,31 +137,41 @@ class ConversationManager:
                 metadata=response.get("metadata")
             )
 
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
 
+    async def stream_message(self, request: MessageRequest) -> AsyncIterator[str]:
+        """Process a message, yielding NDJSON answer deltas and then the full response"""
+        deltas: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(self.process_message(request, on_delta=deltas.put_nowait))
+        task.add_done_callback(lambda _: deltas.put_nowait(None))
+
+        streamed = False
+        try:
+            while (delta := await deltas.get()) is not None:
+                streamed = True
+                yield json.dumps({"delta": delta}) + "\n"
+            response = task.result()
+        except HTTPException as e:
+            # Before any output the error can still become an HTTP status
+            if not streamed:
+                raise
+            yield json.dumps({"error": e.detail}) + "\n"
+            return
+        finally:
+            task.cancel()
+
+        yield json.dumps({"response": jsonable_encoder(response)}) + "\n"
+
     async def _determine_message_type(self, message: str) -> MessageType:
         """Determine the type of message"""
-        # Greeting patterns
-        greeting_patterns = [
-            r"^\s*(?:hi|hello|hey|greetings|good morning|good afternoon|good evening)\s*$",
-            r"^\s*(?:hi|hello|hey)\s+(?:there|everyone|all)\s*$"
-        ]
-        
-        # Check for greetings
-        if any(re.match(pattern, message.lower()) for pattern in greeting_patterns):
+        if _GREETING_RE.match(message):
             return MessageType.GREETING
             
-        # Policy-related keywords
-        policy_keywords = [
-            'policy', 'requirement', 'procedure', 'pace', 'lien',
-            'modification', 'short sale', 'deed', 'loan', 'mortgage',
-            'guidelines', 'rules', 'process'
-        ]
-        
-        # Check for policy-related content
-        if any(keyword in message.lower() for keyword in policy_keywords):
+        if _POLICY_KEYWORDS_RE.search(message):
             return MessageType.POLICY
             
         return MessageType.GENERAL
@@ -120,48 +180,80 @@ class ConversationManager:
         self,
         message_type: MessageType,
         request: MessageRequest,
-        history: List[Dict]
+        history: List[Dict],
+        timestamp: str,
+        on_delta: Optional[Callable[[str], None]] = None
     ) -> Dict:
         """Route message to appropriate handler"""
         if message_type == MessageType.GREETING:
-            return await self._handle_greeting(request)
-        elif message_type == MessageType.POLICY and request.channel:
-            return await self._handle_policy_query(request, history)
+            return await self._handle_greeting(request, timestamp)
+        elif message_type == MessageType.POLICY:
+            return await self._handle_policy_query(request, history, timestamp, on_delta)
         else:
-            return await self._handle_general_message(request)
+            return await self._handle_general_message(request, timestamp)
 
-    async def _handle_greeting(self, request: MessageRequest) -> Dict:
+    async def _handle_greeting(self, request: MessageRequest, timestamp: str) -> Dict:
         """Handle greeting messages"""
         return {
             "answer": random.choice(self.greeting_responses),
             "confidence": 1.0,
             "metadata": {
                 "message_type": "greeting",
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": timestamp
             }
         }
 
     async def _handle_policy_query(
         self, 
         request: MessageRequest, 
-        history: List[Dict]
+        history: List[Dict],
+        timestamp: str,
+        on_delta: Optional[Callable[[str], None]] = None
     ) -> Dict:
         """Handle policy-related queries using RAG system"""
         try:
-            response = await self.rag_system.process_query(
-                query=request.message,
-                channel=request.channel.value,
-                metadata={
-                    'conversation_id': request.conversation_id,
-                    'history': history,
-                    **request.metadata
-                }
+            channel = request.channel.value
+            cache = self.response_caches.setdefault(
+                channel,
+                SemanticCache(threshold=0.87, max_size=1024, quantize=True, ttl=300)
             )
+            # Interactive requests are embedded at once rather than waiting out a batch window
+            query_embedding = await self.embeddings.embed_query(request.message)
+
+            cached = cache.lookup(query_embedding)
+            if cached is not None:
+                logger.info(f"Serving cached response for channel {channel}")
+                response = {**cached, 'metadata': {**cached['metadata'], 'cache_hit': True}}
+            else:
+                response = await self.rag_system.process_query(
+                    query=request.message,
+                    channel=channel,
+                    query_embedding=query_embedding,
+                    on_delta=on_delta,
+                    metadata={
+                        'conversation_id': request.conversation_id,
+                        'history': history,
+                        **request.metadata
+                    }
+                )
+                # Error and no-content responses are not worth replaying; request
+                # specific metadata (history, conversation_id) is not cached
+                if response.get('confidence'):
+                    cache.add(query_embedding, {
+                        'answer': response['answer'],
+                        'citations': response.get('citations', []),
+                        'confidence': response['confidence'],
+                        'metadata': {
+                            key: response['metadata'][key]
+                            for key in ('sources_used', 'search_type')
+                            if key in response['metadata']
+                        }
+                    })
             
             # Enhance response metadata
             response['metadata'].update({
-                'channel': request.channel.value,
-                'timestamp': datetime.utcnow().isoformat(),
+                'channel': channel,
+                'timestamp': timestamp,
                 'conversation_id': request.conversation_id
             })
             
@@ -174,32 +266,58 @@ class ConversationManager:
                 detail="Error processing policy query"
             )
 
-    async def _handle_general_message(self, request: MessageRequest) -> Dict:
+    async def _handle_general_message(self, request: MessageRequest, timestamp: str) -> Dict:
         """Handle general messages"""
         return {
             "answer": random.choice(self.general_responses),
             "confidence": 1.0,
             "metadata": {
                 "message_type": "general",
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": timestamp
             }
         }
 
-    def _update_history(
+    async def _get_history(self, conversation_id: str) -> List[Dict]:
+        """Load conversation history, oldest turn first"""
+        if self.redis:
+            turns = await self.redis.lrange(f"conv:{conversation_id}", 0, -1)
+            return [json.loads(turn) for turn in turns]
+
+        history = self.conversations.get(conversation_id, [])
+        if history:
+            self.conversations.move_to_end(conversation_id)
+        return history
+
+    async def _update_history(
         self,
         conversation_id: str,
         message: str,
-        response: Dict
+        response: Dict,
+        timestamp: str
     ):
         """Update conversation history"""
+        # Only the answer is kept; citations and metadata are not needed as history
+        turn = {
+            "message": message,
+            "answer": response["answer"],
+            "timestamp": timestamp
+        }
+
+        if self.redis:
+            key = f"conv:{conversation_id}"
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.rpush(key, json.dumps(turn))
+                pipe.ltrim(key, -self.max_history, -1)
+                pipe.expire(key, self.history_ttl)
+                await pipe.execute()
+            return
+
         if conversation_id not in self.conversations:
             self.conversations[conversation_id] = []
+            if len(self.conversations) > self.max_conversations:
+                self.conversations.popitem(last=False)
         
-        self.conversations[conversation_id].append({
-            "message": message,
-            "response": response,
-            "timestamp": datetime.utcnow().isoformat()
-        })
+        self.conversations[conversation_id].append(turn)
         
         # Keep only last N messages
         self.conversations[conversation_id] = \
@@ -211,13 +329,27 @@ app = FastAPI(
     version="1.0.0"
 )
 
+conversation_manager: Optional[ConversationManager] = None
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize API dependencies"""
+    global conversation_manager
     setup_ssl_certificates()
     logger.info("API starting up...")
 
-conversation_manager = ConversationManager()
+    # Build the RAG system once and open the embeddings connection before the first request
+    rag_system = await RAGSystem.create()
+    await rag_system.query_processor.embeddings.warmup()
+    conversation_manager = ConversationManager(rag_system)
+    logger.info("RAG system ready")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release API dependencies"""
+    if conversation_manager:
+        await conversation_manager.rag_system.cleanup()
+    await close_openai_client()
 
 app.add_middleware(
     CORSMiddleware,
@@ -230,19 +362,28 @@ app.add_middleware(
 @app.post("/api/message", response_model=MessageResponse)
 async def process_message(request: MessageRequest):
     """Process chat message and return response"""
-    if request.message_type == MessageType.POLICY and not request.channel:
-        raise HTTPException(
-            status_code=400,
-            detail="Channel is required for policy queries"
-        )
     return await conversation_manager.process_message(request)
 
+@app.post("/api/message/stream")
+async def stream_message(request: MessageRequest):
+    """Stream a chat response as newline-delimited JSON: answer deltas, then the full response"""
+    events = conversation_manager.stream_message(request)
+    # Wait for the first event so errors raised before any output keep their status code
+    first_event = await anext(events)
+
+    async def body():
+        yield first_event
+        async for event in events:
+            yield event
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
 @app.get("/health")
 async def health_check():
     """Check API health status"""
     return {
         "status": "healthy",
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": utc_timestamp(),
         "version": "1.0.0"
     }
 
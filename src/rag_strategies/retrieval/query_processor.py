@@ -1,4 +1,9 @@
-from typing import List, Dict
+import hashlib
+import heapq
+import logging
+import re
+from operator import itemgetter
+from typing import List, Dict, Optional, Tuple
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from rag_strategies.config import settings
@@ -7,6 +12,8 @@ from rag_strategies.utils.openai_client import get_embeddings_model, get_llm
 
 logger = setup_logger(__name__)
 
+_WHITESPACE_RE = re.compile(r'\s+')
+
 class QueryProcessor:
     def __init__(self):
         """Initialize QueryProcessor with database connections and models"""
@@ -16,6 +23,7 @@ class QueryProcessor:
         self.chunks_collection = self.db[settings.mongodb_chunks_collection]
         self.embeddings = get_embeddings_model()
         self.llm = get_llm()
+        self.max_chunks = 10
 
     @classmethod
     async def create(cls):
@@ -35,14 +43,15 @@ class QueryProcessor:
         if self.client:
             self.client.close()
 
-    async def search(self, query: str) -> Dict:
+    async def search(self, query: str, query_embedding: Optional[List[float]] = None) -> Dict:
         """Execute search with summary-first approach"""
         try:
-            # Query embedding
-            query_embedding = await self.embeddings.embed_query(query)
+            # Query embedding (callers that already embedded the query pass it in)
+            if query_embedding is None:
+                query_embedding = await self.embeddings.embed_query(query)
             
-            # 1. Search in summaries
-            relevant_summaries = await self._search_summaries(query_embedding)
+            # 1. Search in summaries, with a speculative direct chunk search in the same round trip
+            relevant_summaries, direct_chunks = await self._search_summaries(query_embedding)
             logger.info(f"Found {len(relevant_summaries)} relevant summaries")
 
             # 2. Get chunks from relevant summaries
@@ -54,10 +63,11 @@ class QueryProcessor:
 
             chunks = chunks_from_summaries
             if len(chunks) < 3: 
-                additional_chunks = await self._direct_chunk_search(
-                    query_embedding,
-                    existing_chunk_ids=[str(c['_id']) for c in chunks]
-                )
+                existing_chunk_ids = {c['_id'] for c in chunks}
+                additional_chunks = [
+                    c for c in direct_chunks
+                    if c['_id'] not in existing_chunk_ids
+                ]
                 chunks.extend(additional_chunks)
                 logger.info(f"Added {len(additional_chunks)} additional chunks")
 
@@ -66,6 +76,7 @@ class QueryProcessor:
             return {
                 'chunks': processed_chunks,
                 'summaries': relevant_summaries,
+                'query_embedding': query_embedding,
                 'metadata': {
                     'total_chunks': len(processed_chunks),
                     'summary_count': len(relevant_summaries),
@@ -77,8 +88,8 @@ class QueryProcessor:
             logger.error(f"Search failed: {str(e)}")
             raise
 
-    async def _search_summaries(self, query_embedding: List[float]) -> List[Dict]:
-        """Search in summary collection using vector similarity"""
+    async def _search_summaries(self, query_embedding: List[float]) -> Tuple[List[Dict], List[Dict]]:
+        """Search summaries by vector similarity, unioned with a direct chunk search"""
         try:
             pipeline = [
                 {
@@ -98,26 +109,44 @@ class QueryProcessor:
                         "summary": 1,
                         "source_documents": 1,
                         "metadata": 1,
+                        "summary_embedding": 1,
                         "score": { "$meta": "searchScore" }
                     }
+                },
+                {"$addFields": {"kind": "summary"}},
+                {
+                    "$unionWith": {
+                        "coll": settings.mongodb_chunks_collection,
+                        "pipeline": [
+                            *self._direct_chunk_pipeline(query_embedding),
+                            {"$addFields": {"kind": "chunk"}}
+                        ]
+                    }
                 }
             ]
 
-            results = await self.summary_collection.aggregate(pipeline).to_list(None)
+            results = []
+            direct_chunks = []
+            async for doc in self.summary_collection.aggregate(pipeline):
+                if doc.pop("kind") == "summary":
+                    results.append(doc)
+                else:
+                    direct_chunks.append(doc)
             
             # Log summary results
             logger.info(f"Found {len(results)} summaries from vector search")
-            for idx, summary in enumerate(results):
-                logger.info(f"Summary {idx + 1}:")
-                logger.info(f"  Title: {summary.get('page_title', 'No title')}")
-                logger.info(f"  Score: {summary.get('score', 'No score')}")
-                logger.info(f"  Summary: {summary.get('summary', 'No summary')[:200]}...")
+            if logger.isEnabledFor(logging.DEBUG):
+                for idx, summary in enumerate(results):
+                    logger.debug(f"Summary {idx + 1}:")
+                    logger.debug(f"  Title: {summary.get('page_title', 'No title')}")
+                    logger.debug(f"  Score: {summary.get('score', 'No score')}")
+                    logger.debug(f"  Summary: {summary.get('summary', 'No summary')[:200]}...")
 
-            return results
+            return results, direct_chunks
 
         except Exception as e:
             logger.error(f"Summary search failed: {str(e)}")
-            return []
+            return [], []
 
     async def _get_chunks_from_summaries(
         self,
@@ -134,6 +163,12 @@ class QueryProcessor:
 
             logger.info(f"Searching chunks with {len(summary_ids)} summary IDs and {len(root_ids)} root IDs")
 
+            # Restrict the kNN candidates to the relevant summaries/roots up front, so
+            # all k hits are usable instead of being thrown away by a later $match
+            related_filters = [{"in": {"path": "summary_id", "value": summary_ids}}]
+            if root_ids:
+                related_filters.append({"in": {"path": "root_id", "value": root_ids}})
+
             pipeline = [
                 {
                     "$search": {
@@ -141,74 +176,42 @@ class QueryProcessor:
                         "knnBeta": {
                             "vector": query_embedding,
                             "path": "embedding",
-                            "k": 10
+                            "k": 10,
+                            "filter": {
+                                "compound": {
+                                    "should": related_filters,
+                                    "minimumShouldMatch": 1
+                                }
+                            }
                         }
                     }
                 },
-                {
-                    "$match": {
-                        "$or": [
-                            {"summary_id": {"$in": summary_ids}},
-                            {"root_id": {"$in": root_ids}},
-                        ]
-                    }
-                },
                 {
                     "$project": {
                         "content": 1,
                         "metadata": 1,
                         "root_id": 1,
                         "summary_id": 1,
+                        "embedding": 1,
                         "score": { "$meta": "searchScore" }
                     }
-                },
-                {
-                    "$limit": 10
                 }
             ]
 
-            results = await self.chunks_collection.aggregate(pipeline).to_list(None)
+            results = await self.chunks_collection.aggregate(pipeline).to_list(10)
             
             if results:
                 logger.info(f"Found {len(results)} chunks from related summaries")
-                for idx, chunk in enumerate(results):
-                    logger.info(f"Chunk {idx + 1}:")
-                    logger.info(f"  Score: {chunk.get('score', 'No score')}")
-                    logger.info(f"  Content: {chunk.get('content', 'No content')[:200]}...")
-                    logger.info(f"  Summary ID: {chunk.get('summary_id', 'No summary ID')}")
-                    logger.info(f"  Root ID: {chunk.get('root_id', 'No root ID')}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    for idx, chunk in enumerate(results):
+                        logger.debug(f"Chunk {idx + 1}:")
+                        logger.debug(f"  Score: {chunk.get('score', 'No score')}")
+                        logger.debug(f"  Content: {chunk.get('content', 'No content')[:200]}...")
+                        logger.debug(f"  Summary ID: {chunk.get('summary_id', 'No summary ID')}")
+                        logger.debug(f"  Root ID: {chunk.get('root_id', 'No root ID')}")
             else:
+                # search() falls back to the direct chunks fetched alongside the summaries
                 logger.info("No chunks found from related summaries, falling back to direct search")
-                pipeline = [
-                    {
-                        "$search": {
-                            "index": "complied_answers_test_chunks_embeddings",
-                            "knnBeta": {
-                                "vector": query_embedding,
-                                "path": "embedding",
-                                "k": 5
-                            }
-                        }
-                    },
-                    {
-                        "$project": {
-                            "content": 1,
-                            "metadata": 1,
-                            "root_id": 1,
-                            "summary_id": 1,
-                            "score": { "$meta": "searchScore" }
-                        }
-                    }
-                ]
-                results = await self.chunks_collection.aggregate(pipeline).to_list(None)
-                
-                logger.info(f"Found {len(results)} chunks from fallback search")
-                for idx, chunk in enumerate(results):
-                    logger.info(f"Fallback Chunk {idx + 1}:")
-                    logger.info(f"  Score: {chunk.get('score', 'No score')}")
-                    logger.info(f"  Content: {chunk.get('content', 'No content')[:200]}...")
-                    logger.info(f"  Summary ID: {chunk.get('summary_id', 'No summary ID')}")
-                    logger.info(f"  Root ID: {chunk.get('root_id', 'No root ID')}")
 
             return results
 
@@ -216,85 +219,64 @@ class QueryProcessor:
             logger.error(f"Error getting chunks from summaries: {str(e)}")
             return []
 
-    async def _direct_chunk_search(
-        self,
-        query_embedding: List[float],
-        existing_chunk_ids: List[str]
-    ) -> List[Dict]:
-        """Direct search in chunks collection"""
-        try:
-            pipeline = [
-                {
-                    "$search": {
-                        "index": "complied_answers_test_chunks_embeddings",
-                        "knnBeta": {
-                            "vector": query_embedding,
-                            "path": "embedding",
-                            "k": 10
-                        }
-                    }
-                },
-                {
-                    "$match": {
-                        "_id": { "$nin": existing_chunk_ids }
-                    }
-                },
-                {
-                    "$project": {
-                        "content": 1,
-                        "metadata": 1,
-                        "root_id": 1,
-                        "summary_id": 1,
-                        "score": { "$meta": "searchScore" },
-                        "_id": 1
+    def _direct_chunk_pipeline(self, query_embedding: List[float]) -> List[Dict]:
+        """Pipeline for a direct kNN search in the chunks collection"""
+        return [
+            {
+                "$search": {
+                    "index": "complied_answers_test_chunks_embeddings",
+                    "knnBeta": {
+                        "vector": query_embedding,
+                        "path": "embedding",
+                        "k": 10
                     }
-                },
-                {
-                    "$limit": 5
                 }
-            ]
-
-            results = await self.chunks_collection.aggregate(pipeline).to_list(None)
-            
-            logger.info(f"Found {len(results)} additional chunks from direct search")
-            for idx, chunk in enumerate(results):
-                logger.info(f"Additional Chunk {idx + 1}:")
-                logger.info(f"  Score: {chunk.get('score', 'No score')}")
-                logger.info(f"  Content: {chunk.get('content', 'No content')[:200]}...")
-                logger.info(f"  Summary ID: {chunk.get('summary_id', 'No summary ID')}")
-                logger.info(f"  Root ID: {chunk.get('root_id', 'No root ID')}")
-
-            return results
-
-        except Exception as e:
-            logger.error(f"Direct chunk search failed: {str(e)}")
-            return []
+            },
+            {
+                "$project": {
+                    "content": 1,
+                    "metadata": 1,
+                    "root_id": 1,
+                    "summary_id": 1,
+                    "embedding": 1,
+                    "score": { "$meta": "searchScore" },
+                    "_id": 1
+                }
+            },
+            {
+                "$limit": 5
+            }
+        ]
 
     def _process_chunks(self, chunks: List[Dict]) -> List[Dict]:
         """Process and deduplicate chunks"""
+        # Only a short digest of each normalized chunk is kept for the membership check
         seen_content = set()
         processed_chunks = []
         
         for chunk in chunks:
-            normalized_content = self._normalize_content(chunk['content'])
+            content_digest = hashlib.blake2b(
+                self._normalize_content(chunk['content']).encode(),
+                digest_size=16
+            ).digest()
             
-            if normalized_content not in seen_content:
-                seen_content.add(normalized_content)
+            if content_digest not in seen_content:
+                seen_content.add(content_digest)
                 
                 processed_chunk = {
                     "content": chunk['content'],
                     "metadata": chunk.get('metadata', {}),
                     "root_id": chunk.get('root_id'),
                     "summary_id": chunk.get('summary_id'),
+                    "embedding": chunk.get('embedding'),
                     "score": chunk.get('score', 0.7)
                 }
                 
                 processed_chunks.append(processed_chunk)
         
-        # Sort by score
-        processed_chunks.sort(key=lambda x: x['score'], reverse=True)
-        return processed_chunks
+        # Highest scoring chunks first, bounded to what the response prompt uses
+        return heapq.nlargest(self.max_chunks, processed_chunks, key=itemgetter('score'))
 
     def _normalize_content(self, content: str) -> str:
         """Normalize content for deduplication"""
-        return ' '.join(content.lower().split())
+        return _WHITESPACE_RE.sub(' ', content).strip().lower()
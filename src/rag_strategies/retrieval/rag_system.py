@@ -1,9 +1,10 @@
-from typing import List, Dict, Optional
-from datetime import datetime
+import asyncio
+from typing import Callable, List, Dict, Optional
 
 from rag_strategies.retrieval.query_processor import QueryProcessor
 from rag_strategies.retrieval.response_generator import ResponseGenerator
 from rag_strategies.utils.logger import setup_logger
+from rag_strategies.utils.time_utils import utc_timestamp
 
 logger = setup_logger(__name__)
 
@@ -18,40 +19,44 @@ class RAGSystem:
         self = cls()
         try:
             self.query_processor = await QueryProcessor.create()
-            self.response_generator = await ResponseGenerator.create()
+            self.response_generator = ResponseGenerator()
             return self
         except Exception as e:
             logger.error(f"Failed to initialize RAG System: {str(e)}")
             raise
 
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.cleanup()
+
     async def process_query(
         self,
         query: str,
-        metadata: Optional[Dict] = None
+        metadata: Optional[Dict] = None,
+        channel: Optional[str] = None,
+        query_embedding: Optional[List[float]] = None,
+        on_delta: Optional[Callable[[str], None]] = None
     ) -> Dict:
-        """Process query and generate response"""
+        """Process query and generate response, streaming answer text to on_delta if given"""
         try:
+            if channel:
+                metadata = {'channel': channel, **(metadata or {})}
+
             # 1. Search in summaries and get relevant chunks
-            search_results = await self.query_processor.search(query)
+            search_results = await self.query_processor.search(query, query_embedding)
             
             # 2. Generate response
             response = await self.response_generator.generate_response(
                 query=query,
                 search_result=search_results,
-                metadata=metadata
+                metadata=metadata,
+                on_delta=on_delta
             )
 
             # 3. Add basic processing info
-            response['metadata'] = {
-                **response.get('metadata', {}),
-                'processed_at': datetime.utcnow().isoformat(),
-                'sources_used': {
-                    'summaries': len(search_results.get('summaries', [])),
-                    'chunks': len(search_results.get('chunks', []))
-                }
-            }
-
-            return response
+            return self._add_processing_info(response, search_results)
 
         except Exception as e:
             logger.error(f"Error processing query: {str(e)}")
@@ -65,26 +70,61 @@ class RAGSystem:
     async def process_batch_queries(
         self,
         queries: List[str],
-        metadata: Optional[Dict] = None
+        metadata: Optional[Dict] = None,
+        use_batch_api: bool = False
     ) -> List[Dict]:
-        """Process multiple queries"""
-        responses = []
-        
-        for query in queries:
+        """Process multiple queries; use_batch_api answers through the OpenAI Batch API (half the cost, up to 24h)"""
+        if not queries:
+            return []
+
+        # One embeddings request for the whole batch, then every search concurrently
+        query_embeddings = await self.query_processor.embeddings.embed_documents(queries)
+        search_results = await asyncio.gather(
+            *[self.query_processor.search(q, e) for q, e in zip(queries, query_embeddings)],
+            return_exceptions=True
+        )
+
+        results: List[Optional[Dict]] = [None] * len(queries)
+        searched = []
+        for i, search_result in enumerate(search_results):
+            if isinstance(search_result, Exception):
+                logger.error(f"Error processing query '{queries[i]}': {str(search_result)}")
+                results[i] = {"error": str(search_result), "query": queries[i]}
+            else:
+                searched.append(i)
+
+        if searched:
+            generate = (
+                self.response_generator.generate_responses_batch if use_batch_api
+                else self.response_generator.generate_responses
+            )
             try:
-                response = await self.process_query(
-                    query=query,
-                    metadata=metadata
+                responses = await generate(
+                    [queries[i] for i in searched],
+                    [search_results[i] for i in searched],
+                    metadata
                 )
-                responses.append(response)
+                for i, response in zip(searched, responses):
+                    results[i] = self._add_processing_info(response, search_results[i])
             except Exception as e:
-                logger.error(f"Error processing query '{query}': {str(e)}")
-                responses.append({
-                    "error": str(e),
-                    "query": query
-                })
+                logger.error(f"Error generating batch responses: {str(e)}")
+                for i in searched:
+                    results[i] = {"error": str(e), "query": queries[i]}
+
+        return results
 
-        return responses
+    def _add_processing_info(self, response: Dict, search_results: Dict) -> Dict:
+        """Stamp processing time; the generator's sources_used counts the deduplicated
+        sources actually in the prompt, so raw search counts are only a fallback"""
+        response['metadata'] = {
+            'sources_used': {
+                'summaries': len(search_results.get('summaries', [])),
+                'chunks': len(search_results.get('chunks', []))
+            },
+            **response.get('metadata', {}),
+            'processed_at': utc_timestamp()
+        }
+        return response
 
     async def cleanup(self):
         """Cleanup resources"""
@@ -1,14 +1,109 @@
-# TODO- update how we calculate confidence score by using cosine similarity 
-from typing import List, Dict, Optional
+import asyncio
+import hashlib
+import json
+from typing import Callable, List, Dict, Optional, Tuple
 from dataclasses import dataclass
-from datetime import datetime
 
-from rag_strategies import get_llm, get_embeddings_model
+import numpy as np
+
+from rag_strategies import get_llm, get_embeddings_model, get_openai_client, get_openai_semaphore, settings
 from rag_strategies.utils.logger import setup_logger
+from rag_strategies.utils.time_utils import utc_timestamp
 
 logger = setup_logger(__name__)
 
-@dataclass
+# Static prompt text is built once; only the question and context are filled in per request
+_COMPREHENSIVE_PROMPT = """
+Answer the following question using the provided context.
+
+Question: {query}
+
+Context:
+{context}
+
+Requirements:
+1. Answer directly and concisely - aim for 3-4 sentences unless more detail is absolutely necessary
+2. Use only information from the provided context
+3. If multiple sources provide different information, note the differences briefly
+4. If the information is incomplete, acknowledge what's missing
+5. Use simple text formatting without markdown, bullets, or special characters
+6. Start with a direct answer, then provide necessary context or conditions
+7. Do not use headers, sections, or extensive formatting
+8. Do not use bold, italics, or other markdown formatting
+9. Keep the response focused and to the point
+10. If a longer response is needed, organize it in clear paragraphs
+
+Example of good response format:
+The maximum debt-to-income ratio for conventional loans is typically 45%, but it can go up to 50% with strong compensating factors such as excellent credit score and significant reserves. Different loan types may have varying requirements, with FHA allowing up to 57% in some cases. The specific limit depends on the loan program, property type, and borrower's overall financial profile.
+
+Answer:
+"""
+
+_CHUNKS_PROMPT = """
+Answer the following question using only the provided information.
+
+Question: {query}
+
+Information:
+{context}
+
+Requirements:
+1. Use only the information from the provided content
+2. Be concise and direct - aim for 3-4 sentences unless more detail is absolutely necessary
+3. If information is missing or unclear, state that explicitly
+4. Use simple text formatting without markdown, bullets, or special characters
+5. If there are conditions or exceptions, include them briefly in the main response
+6. Start with a direct answer, then provide necessary context or conditions
+7. Do not use headers, sections, or extensive formatting
+8. Do not use bold, italics, or other markdown formatting
+9. Keep the response focused and to the point
+10. If a longer response is needed, organize it in clear paragraphs
+
+Example of good response format:
+A property can be considered a primary residence if the client occupies it as their main home within 60 days of closing and intends to live there. The client must not own or occupy another primary residence at the same time. Special provisions exist for military personnel and remote workers, where occupancy by a spouse or family member may be permitted with proper documentation.
+
+Answer:
+"""
+
+_MAP_PROMPT = """
+Using only this source, answer the question in 1-3 sentences.
+If the source does not address the question, reply exactly: NOT RELEVANT
+
+Question: {query}
+
+Source:
+{source}
+"""
+
+_REDUCE_PROMPT = """
+Combine these partial answers into one answer to the question.
+
+Question: {query}
+
+Partial answers:
+{partial_answers}
+
+Requirements:
+1. Answer directly and concisely - aim for 3-4 sentences unless more detail is absolutely necessary
+2. Use only information from the partial answers
+3. If they disagree, note the differences briefly
+4. Use simple text formatting without markdown, bullets, or special characters
+
+Answer:
+"""
+
+_BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# Chunks at least this similar to a chunk already in the prompt add no new information
+_NEAR_DUPLICATE_SIMILARITY = 0.95
+
+def _cosine_confidence(query_embedding: np.ndarray, embeddings: np.ndarray) -> np.ndarray:
+    """Cosine similarity of every row against the query in one matrix-vector product"""
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    scores = embeddings @ (query_embedding / np.linalg.norm(query_embedding))
+    return np.clip(np.nan_to_num(scores), 0.0, 1.0)
+
+@dataclass(slots=True, frozen=True)
 class Citation:
     """Structure for holding citation information"""
     content: str
@@ -16,108 +111,270 @@ class Citation:
     metadata: Dict
     confidence: float
 
+    def to_dict(self) -> Dict:
+        """Citation in the shape returned by the API"""
+        return {
+            "content": self.content,
+            "metadata": {
+                "document_path": self.document_path,
+                "metadata": self.metadata,
+                "confidence": self.confidence
+            }
+        }
+
 class ResponseGenerator:
-    def __init__(self):
-        self.llm = None
-        self.embeddings = None
-
-    @classmethod
-    async def create(cls):
-        """Factory method to create instance"""
-        self = cls()
-        try:
-            self.llm = get_llm()
-            self.embeddings = get_embeddings_model()
-            return self
-        except Exception as e:
-            logger.error(f"Failed to initialize ResponseGenerator: {str(e)}")
-            raise
+    """Answers queries from search results using the shared OpenAI client"""
+
+    @property
+    def llm(self):
+        return get_llm()
+
+    @property
+    def embeddings(self):
+        return get_embeddings_model()
 
     async def generate_response(
         self,
         query: str,
         search_result: Dict,
-        metadata: Optional[Dict] = None
+        metadata: Optional[Dict] = None,
+        on_delta: Optional[Callable[[str], None]] = None
     ) -> Dict:
-        """Generate response using search results"""
+        """Generate response using search results, passing answer text to on_delta as it streams"""
         try:
             if not search_result.get('chunks') and not search_result.get('summaries'):
                 return self._create_no_content_response()
 
-            if search_result.get('summaries'):
-                logger.info("Generating response from summaries and chunks")
-                response = await self._generate_comprehensive_response(
-                    query,
-                    search_result,
-                    metadata
-                )
-            else:
-                logger.info("Generating response from chunks only")
-                response = await self._generate_chunks_response(
-                    query,
-                    search_result,
-                    metadata
-                )
-
-            response['metadata'].update({
-                'processed_at': datetime.utcnow().isoformat(),
-                'search_type': search_result.get('metadata', {}).get('search_type', 'unknown'),
-                **(metadata or {})
-            })
-
-            return response
+            # Deduplication, string building and token counting run off the event loop
+            search_result, prompt, sources, num_tokens = await asyncio.to_thread(
+                self._prepare_prompt, query, search_result
+            )
+
+            # Citations are scored in a thread while the LLM call is in flight
+            answer, response = await asyncio.gather(
+                self._generate_answer(query, prompt, sources, num_tokens, on_delta),
+                asyncio.to_thread(self._build_response, search_result)
+            )
+            response['answer'] = answer
+
+            return self._add_response_metadata(response, search_result, metadata)
 
         except Exception as e:
             logger.error(f"Error generating response: {str(e)}")
             return self._create_error_response(str(e))
 
-    async def _generate_comprehensive_response(
+    async def generate_responses(
         self,
-        query: str,
-        search_result: Dict,
-        metadata: Optional[Dict]
-    ) -> Dict:
-        """Generate response using both summaries and chunks"""
+        queries: List[str],
+        search_results: List[Dict],
+        metadata: Optional[Dict] = None
+    ) -> List[Dict]:
+        """Generate responses for a batch of queries concurrently; use this instead of awaiting generate_response in a loop"""
+        # LLM calls are bounded by the shared OpenAI semaphore
+        return await asyncio.gather(*[
+            self.generate_response(query, search_result, metadata)
+            for query, search_result in zip(queries, search_results)
+        ])
+
+    async def generate_responses_batch(
+        self,
+        queries: List[str],
+        search_results: List[Dict],
+        metadata: Optional[Dict] = None,
+        poll_interval: float = 30.0
+    ) -> List[Dict]:
+        """Generate responses through the OpenAI Batch API; half the cost but may take up to 24h, so offline use only"""
         try:
-            summaries = search_result['summaries']
-            chunks = search_result['chunks']
-
-            context = self._create_comprehensive_context(summaries, chunks)
+            responses: List[Optional[Dict]] = [None] * len(queries)
+            pending = []
+            for i, search_result in enumerate(search_results):
+                if search_result.get('chunks') or search_result.get('summaries'):
+                    pending.append(i)
+                else:
+                    responses[i] = self._create_no_content_response()
+
+            built = await asyncio.gather(*[
+                asyncio.to_thread(self._prepare_prompt, queries[i], search_results[i])
+                for i in pending
+            ])
+
+            # Over-budget prompts are mapped per source in the first batch and
+            # reduced in a second one, as _generate_answer does online
+            prompts = {}
+            oversized: Dict[int, int] = {}
+            unique_results = {}
+            for i, (unique_result, prompt, sources, num_tokens) in zip(pending, built):
+                unique_results[i] = unique_result
+                if num_tokens <= settings.response_max_prompt_tokens:
+                    prompts[str(i)] = prompt
+                    continue
+                oversized[i] = len(sources)
+                for j, source in enumerate(sources):
+                    prompts[f"{i}:{j}"] = _MAP_PROMPT.format(query=queries[i], source=source)
+
+            answers = await self._run_batch(prompts, poll_interval) if prompts else {}
+
+            reduce_prompts = {}
+            for i, num_sources in oversized.items():
+                partial_answers = [
+                    answers[f"{i}:{j}"] for j in range(num_sources) if f"{i}:{j}" in answers
+                ]
+                if partial_answers:
+                    reduce_prompts[str(i)] = self._reduce_prompt(queries[i], partial_answers)
+            if reduce_prompts:
+                answers.update(await self._run_batch(reduce_prompts, poll_interval))
+
+            for i in pending:
+                if str(i) not in answers:
+                    responses[i] = self._create_error_response("Batch request failed")
+                    continue
+                response = self._build_response(unique_results[i])
+                response['answer'] = answers[str(i)]
+                responses[i] = self._add_response_metadata(response, search_results[i], metadata)
+
+            return responses
 
-            prompt = f"""
-            Answer the following question using the provided context. 
-            
-            Question: {query}
-
-            Context:
-            {context}
-
-            Requirements:
-            1. Answer directly and concisely - aim for 3-4 sentences unless more detail is absolutely necessary
-            2. Use only information from the provided context
-            3. If multiple sources provide different information, note the differences briefly
-            4. If the information is incomplete, acknowledge what's missing
-            5. Use simple text formatting without markdown, bullets, or special characters
-            6. Start with a direct answer, then provide necessary context or conditions
-            7. Do not use headers, sections, or extensive formatting
-            8. Do not use bold, italics, or other markdown formatting
-            9. Keep the response focused and to the point
-            10. If a longer response is needed, organize it in clear paragraphs
-
-            Example of good response format:
-            The maximum debt-to-income ratio for conventional loans is typically 45%, but it can go up to 50% with strong compensating factors such as excellent credit score and significant reserves. Different loan types may have varying requirements, with FHA allowing up to 57% in some cases. The specific limit depends on the loan program, property type, and borrower's overall financial profile.
-
-            Answer:
-            """
+        except Exception as e:
+            logger.error(f"Error generating batch responses: {str(e)}")
+            raise
 
-            response = await self.llm.ainvoke(prompt)
-            answer = response.content if hasattr(response, 'content') else str(response)
+    async def _run_batch(self, prompts: Dict[str, str], poll_interval: float) -> Dict[str, str]:
+        """Submit one chat completion per prompt as a batch job and wait for the answers"""
+        requests = [
+            {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.llm.model_name,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": self.llm.temperature,
+                    "max_tokens": self.llm.max_tokens,
+                    "top_p": self.llm.top_p
+                }
+            }
+            for custom_id, prompt in prompts.items()
+        ]
+        payload = "\n".join(json.dumps(request) for request in requests).encode()
+
+        # Shared client: same connection pool, timeouts and retries as the chat calls
+        client = get_openai_client()
+        input_file = await client.files.create(file=("responses.jsonl", payload), purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        logger.info(f"Submitted batch {batch.id} with {len(requests)} requests")
+
+        while batch.status not in _BATCH_FINAL_STATUSES:
+            await asyncio.sleep(poll_interval)
+            batch = await client.batches.retrieve(batch.id)
+
+        if batch.status != "completed":
+            raise RuntimeError(f"Batch {batch.id} ended with status {batch.status}")
+        if not batch.output_file_id:
+            return {}
+
+        output = await client.files.content(batch.output_file_id)
+
+        answers = {}
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") != 200:
+                logger.warning(f"Batch request {result.get('custom_id')} failed: {result.get('error')}")
+                continue
+            answers[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+
+        logger.info(f"Batch {batch.id} returned {len(answers)} of {len(requests)} answers")
+        return answers
+
+    def _prepare_prompt(self, query: str, search_result: Dict) -> Tuple[Dict, str, List[str], int]:
+        """Deduplicated search result plus the prompt built from it (blocking)"""
+        summaries, chunks = self._unique_sources(
+            search_result.get('summaries', []),
+            search_result.get('chunks', [])
+        )
+        # Citations, sources_used and confidence are built from the same sources as the prompt
+        search_result = {**search_result, 'summaries': summaries, 'chunks': chunks}
+        return (search_result, *self._build_prompt(query, search_result))
+
+    def _build_prompt(self, query: str, search_result: Dict) -> Tuple[str, List[str], int]:
+        """Prompt for the query, the individual source texts it was built from, and its token count (blocking)"""
+        summaries = search_result.get('summaries', [])
+        chunks = search_result.get('chunks', [])
 
-            citations = self._create_citations(summaries, chunks)
+        if summaries:
+            logger.info("Generating response from summaries and chunks")
+            context = self._create_comprehensive_context(summaries, chunks)
+            sources = [summary.get('summary', '') for summary in summaries] + \
+                [chunk.get('content', '') for chunk in chunks]
+            prompt = _COMPREHENSIVE_PROMPT.format(query=query, context=context)
+            return prompt, sources, self.llm.get_num_tokens(prompt)
+
+        logger.info("Generating response from chunks only")
+        sources = [chunk.get('content', '') for chunk in chunks]
+        prompt = _CHUNKS_PROMPT.format(
+            query=query,
+            context=self._format_chunks_for_prompt(chunks)
+        )
+        return prompt, sources, self.llm.get_num_tokens(prompt)
+
+    def _unique_sources(
+        self,
+        summaries: List[Dict],
+        chunks: List[Dict]
+    ) -> Tuple[List[Dict], List[Dict]]:
+        """Drop repeated summary/chunk texts, and chunks nearly identical to one already kept"""
+        seen = set()
+
+        def is_new(text: str) -> bool:
+            digest = hashlib.blake2b(text.strip().encode(), digest_size=16).digest()
+            if digest in seen:
+                return False
+            seen.add(digest)
+            return True
+
+        unique_summaries = [summary for summary in summaries if is_new(summary.get('summary', ''))]
+        unique_chunks = [chunk for chunk in chunks if is_new(chunk.get('content', ''))]
+        return unique_summaries, self._drop_near_duplicates(unique_chunks)
+
+    def _drop_near_duplicates(self, chunks: List[Dict]) -> List[Dict]:
+        """Keep chunks in order, skipping any whose stored embedding nearly matches a kept chunk"""
+        if len(chunks) < 2 or any(not chunk.get('embedding') for chunk in chunks):
+            return chunks
+
+        embeddings = np.asarray([chunk['embedding'] for chunk in chunks], dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        # A zero vector is similar to nothing, so it is always kept
+        norms[norms == 0] = 1.0
+        embeddings /= norms
+        similarities = embeddings @ embeddings.T
+
+        kept = []
+        for i in range(len(chunks)):
+            if kept and similarities[i, kept].max() >= _NEAR_DUPLICATE_SIMILARITY:
+                continue
+            kept.append(i)
+
+        if len(kept) < len(chunks):
+            logger.info(f"Dropped {len(chunks) - len(kept)} near-duplicate chunks from the prompt")
+        return [chunks[i] for i in kept]
+
+    def _build_response(self, search_result: Dict) -> Dict:
+        """Response body with citations and confidence; the answer is filled in by the caller"""
+        summaries = search_result.get('summaries', [])
+        chunks = search_result.get('chunks', [])
+        query_embedding = search_result.get('query_embedding')
 
+        if summaries:
+            citations = self._create_citations(summaries, chunks, query_embedding)
             return {
-                "answer": answer,
-                "citations": citations,
+                "answer": "",
+                "citations": [citation.to_dict() for citation in citations],
                 "metadata": {
                     "sources_used": {
                         "summaries": len(summaries),
@@ -127,65 +384,80 @@ class ResponseGenerator:
                 "confidence": self._calculate_confidence(citations, summaries)
             }
 
-        except Exception as e:
-            logger.error(f"Error in comprehensive response generation: {str(e)}")
-            raise
+        citations = self._create_chunk_citations(chunks, query_embedding)
+        return {
+            "answer": "",
+            "citations": [citation.to_dict() for citation in citations],
+            "metadata": {
+                "sources_used": {
+                    "chunks": len(chunks)
+                }
+            },
+            "confidence": self._calculate_chunk_confidence(citations)
+        }
 
-    async def _generate_chunks_response(
+    def _add_response_metadata(
         self,
-        query: str,
+        response: Dict,
         search_result: Dict,
         metadata: Optional[Dict]
     ) -> Dict:
-        """Generate response using only chunks"""
-        try:
-            chunks = search_result['chunks']
-            
-            prompt = f"""
-            Answer the following question using only the provided information.
-            
-            Question: {query}
-
-            Information:
-            {self._format_chunks_for_prompt(chunks)}
-
-            Requirements:
-            1. Use only the information from the provided content
-            2. Be concise and direct - aim for 3-4 sentences unless more detail is absolutely necessary
-            3. If information is missing or unclear, state that explicitly
-            4. Use simple text formatting without markdown, bullets, or special characters
-            5. If there are conditions or exceptions, include them briefly in the main response
-            6. Start with a direct answer, then provide necessary context or conditions
-            7. Do not use headers, sections, or extensive formatting
-            8. Do not use bold, italics, or other markdown formatting
-            9. Keep the response focused and to the point
-            10. If a longer response is needed, organize it in clear paragraphs
-
-            Example of good response format:
-            A property can be considered a primary residence if the client occupies it as their main home within 60 days of closing and intends to live there. The client must not own or occupy another primary residence at the same time. Special provisions exist for military personnel and remote workers, where occupancy by a spouse or family member may be permitted with proper documentation.
-
-            Answer:
-            """
-
+        """Stamp the response with processing time, search type and caller metadata"""
+        response['metadata'].update({
+            'processed_at': utc_timestamp(),
+            'search_type': search_result.get('metadata', {}).get('search_type', 'unknown'),
+            **(metadata or {})
+        })
+        return response
+
+    async def _generate_answer(
+        self,
+        query: str,
+        prompt: str,
+        sources: List[str],
+        num_tokens: int,
+        on_delta: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """Answer in one call, or map over sources and reduce when the prompt exceeds the token budget"""
+        if num_tokens <= settings.response_max_prompt_tokens:
+            if on_delta:
+                return await self._stream_llm(prompt, on_delta)
+            return await self._invoke_llm(prompt)
+
+        logger.info(f"Prompt over budget, answering from {len(sources)} sources in parallel")
+        partial_answers = await asyncio.gather(*[
+            self._invoke_llm(_MAP_PROMPT.format(query=query, source=source))
+            for source in sources
+        ])
+
+        reduce_prompt = self._reduce_prompt(query, list(partial_answers))
+        if on_delta:
+            return await self._stream_llm(reduce_prompt, on_delta)
+        return await self._invoke_llm(reduce_prompt)
+
+    def _reduce_prompt(self, query: str, partial_answers: List[str]) -> str:
+        """Prompt combining the relevant per-source answers into one"""
+        relevant_answers = [answer for answer in partial_answers if answer.strip() != "NOT RELEVANT"]
+        if not relevant_answers:
+            relevant_answers = partial_answers
+        formatted_answers = "\n".join(f"- {answer}" for answer in relevant_answers)
+        return _REDUCE_PROMPT.format(query=query, partial_answers=formatted_answers)
+
+    async def _invoke_llm(self, prompt: str) -> str:
+        """Send a prompt to the LLM under the shared OpenAI concurrency limit"""
+        async with get_openai_semaphore():
             response = await self.llm.ainvoke(prompt)
-            answer = response.content if hasattr(response, 'content') else str(response)
-
-            citations = self._create_chunk_citations(chunks)
-
-            return {
-                "answer": answer,
-                "citations": citations,
-                "metadata": {
-                    "sources_used": {
-                        "chunks": len(chunks)
-                    }
-                },
-                "confidence": self._calculate_chunk_confidence(citations)
-            }
-
-        except Exception as e:
-            logger.error(f"Error in chunks response generation: {str(e)}")
-            raise
+        return response.content if hasattr(response, 'content') else str(response)
+
+    async def _stream_llm(self, prompt: str, on_delta: Callable[[str], None]) -> str:
+        """Stream the LLM answer token by token to on_delta and return the full text"""
+        parts = []
+        async with get_openai_semaphore():
+            async for chunk in self.llm.astream(prompt):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    on_delta(chunk.content)
+        return "".join(parts)
 
     def _create_comprehensive_context(
         self,
@@ -193,104 +465,117 @@ class ResponseGenerator:
         chunks: List[Dict]
     ) -> str:
         """Create context from summaries and chunks"""
-        context_parts = []
-
-        # Add summary context
-        for summary in summaries:
-            context_parts.append(f"""
-            Summary:
-            {summary.get('summary', '')}
-            """)
-
-        # Add relevant chunks
-        for chunk in chunks:
-            context_parts.append(f"""
-            Detail:
-            {chunk.get('content', '')}
-            """)
-
+        context_parts: List[str] = [
+            f"Summary:\n{summary.get('summary', '').strip()}" for summary in summaries
+        ]
+        context_parts.extend(
+            f"Detail:\n{chunk.get('content', '').strip()}" for chunk in chunks
+        )
         return "\n\n".join(context_parts)
 
     def _create_citations(
         self,
         summaries: List[Dict],
-        chunks: List[Dict]
-    ) -> List[Dict]:
+        chunks: List[Dict],
+        query_embedding: Optional[List[float]] = None
+    ) -> List[Citation]:
         """Create citations from summaries and chunks"""
-        citations = []
+        confidences = self._citation_confidences(
+            query_embedding,
+            summaries,
+            'summary_embedding',
+            [0.9] * len(summaries)
+        )
 
         # Add summary citations
-        for summary in summaries:
-            citations.append({
-                "content": summary.get('summary', ''),
-                "metadata": {
-                    "document_path": "summary",
-                    "metadata": summary.get('metadata', {}),
-                    # TODO - add the code to use cosine similarity to get the confidence score based on semantic, relevance, similarity etc.
-                    # instead of hard coded value
-                    "confidence": 0.9 
-                }
-            })
+        citations = [
+            Citation(
+                content=summary.get('summary', ''),
+                document_path="summary",
+                metadata=summary.get('metadata', {}),
+                confidence=confidence
+            )
+            for summary, confidence in zip(summaries, confidences)
+        ]
 
-        citations.extend(self._create_chunk_citations(chunks))
+        citations.extend(self._create_chunk_citations(chunks, query_embedding))
 
         return citations
 
-    def _create_chunk_citations(self, chunks: List[Dict]) -> List[Dict]:
+    def _create_chunk_citations(
+        self,
+        chunks: List[Dict],
+        query_embedding: Optional[List[float]] = None
+    ) -> List[Citation]:
         """Create citations from chunks"""
+        confidences = self._citation_confidences(
+            query_embedding,
+            chunks,
+            'embedding',
+            [chunk.get('score', 0.7) for chunk in chunks]
+        )
         return [
-            {
-                "content": chunk.get('content', ''),
-                "metadata": {
-                    "document_path": chunk.get('metadata', {}).get('component_path', ''),
-                    "metadata": chunk.get('metadata', {}),
-                    "confidence": chunk.get('score', 0.7)
-                }
-            }
-            for chunk in chunks
+            Citation(
+                content=chunk.get('content', ''),
+                document_path=chunk.get('metadata', {}).get('component_path', ''),
+                metadata=chunk.get('metadata', {}),
+                confidence=confidence
+            )
+            for chunk, confidence in zip(chunks, confidences)
         ]
 
+    def _citation_confidences(
+        self,
+        query_embedding: Optional[List[float]],
+        documents: List[Dict],
+        embedding_field: str,
+        defaults: List[float]
+    ) -> List[float]:
+        """Cosine similarity of each document's stored embedding to the query, else the defaults"""
+        if query_embedding is None or not documents or any(not doc.get(embedding_field) for doc in documents):
+            return defaults
+
+        embeddings = np.asarray([doc[embedding_field] for doc in documents], dtype=np.float32)
+        return _cosine_confidence(np.asarray(query_embedding, dtype=np.float32), embeddings).tolist()
+
     def _calculate_confidence(
         self,
-        citations: List[Dict],
+        citations: List[Citation],
         summaries: List[Dict]
     ) -> float:
         """Calculate overall confidence score"""
         if not citations:
             return 0.0
 
-        scores = []
-        
+        citation_score = self._mean_citation_confidence(citations)
+
         # Consider summary presence
         if summaries:
-            scores.append(0.9)
-        
-        # Consider citation scores
-        citation_scores = [cit['metadata']['confidence'] for cit in citations]
-        if citation_scores:
-            scores.append(sum(citation_scores) / len(citation_scores))
-
-        return min(0.95, sum(scores) / len(scores))
+            return min(0.95, (0.9 + citation_score) / 2)
+        return min(0.95, citation_score)
 
-    def _calculate_chunk_confidence(self, citations: List[Dict]) -> float:
+    def _calculate_chunk_confidence(self, citations: List[Citation]) -> float:
         """Calculate confidence for chunk-based response"""
         if not citations:
             return 0.0
 
-        scores = [cit['metadata']['confidence'] for cit in citations]
-        return min(0.95, sum(scores) / len(scores))
+        return min(0.95, self._mean_citation_confidence(citations))
+
+    def _mean_citation_confidence(self, citations: List[Citation]) -> float:
+        """Mean of the per-citation confidence scores"""
+        scores = np.fromiter(
+            (citation.confidence for citation in citations),
+            dtype=np.float64,
+            count=len(citations)
+        )
+        return float(scores.mean())
 
     def _format_chunks_for_prompt(self, chunks: List[Dict]) -> str:
         """Format chunks for prompt"""
-        formatted_chunks = []
-        
-        for i, chunk in enumerate(chunks, 1):
-            formatted_chunks.append(f"""
-            Source {i}:
-            {chunk.get('content', '')}
-            """)
-            
-        return "\n".join(formatted_chunks)
+        return "\n\n".join(
+            f"Source {i}:\n{chunk.get('content', '').strip()}"
+            for i, chunk in enumerate(chunks, 1)
+        )
 
     def _create_no_content_response(self) -> Dict:
         """Create response for no content found"""
@@ -310,7 +595,7 @@ class ResponseGenerator:
             "citations": [],
             "metadata": {
                 "error": error,
-                "error_time": datetime.utcnow().isoformat()
+                "error_time": utc_timestamp()
             },
             "confidence": 0.0
         }
@@ -2,13 +2,18 @@
 Utility functions and helpers for the RAG Strategies package.
 """
 
-from rag_strategies.utils.openai_client import get_llm, get_embeddings_model
+from rag_strategies.utils.openai_client import get_llm, get_embeddings_model, get_openai_semaphore
 from rag_strategies.utils.logger import setup_logger
 from rag_strategies.utils.ssl_utils import setup_ssl_certificates
+from rag_strategies.utils.semantic_cache import SemanticCache
+from rag_strategies.utils.time_utils import utc_timestamp
 
 __all__ = [
     'get_llm',
     'get_embeddings_model',
+    'get_openai_semaphore',
     'setup_logger',
-    'setup_ssl_certificates'
+    'setup_ssl_certificates',
+    'SemanticCache',
+    'utc_timestamp'
 ]
@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from rag_strategies.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Persisted vectors are dropped after this long, so the file stays bounded
+_DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+# How often writes also prune expired rows
+_PRUNE_INTERVAL_SECONDS = 24 * 3600
+
+def embedding_key(model: str, text: str) -> str:
+    """Cache key for a text embedded by a given model"""
+    return hashlib.sha256(f"{model}\n{text}".encode()).hexdigest()
+
+class EmbeddingCache:
+    """Embedding vectors keyed by content hash: an in-memory LRU in front of optional SQLite"""
+
+    def __init__(
+        self,
+        database_path: Optional[str] = None,
+        memory_size: int = 4096,
+        ttl: float = _DEFAULT_TTL_SECONDS
+    ):
+        # float32 arrays rather than lists of boxed Python floats
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memory_size = memory_size
+        self.ttl = ttl
+        # SQLite calls run in worker threads, one at a time
+        self._db_lock = Lock()
+        self._last_pruned = 0.0
+        self._conn = None
+        if database_path:
+            self._conn = sqlite3.connect(database_path, check_same_thread=False)
+            # Tables from earlier versions (float64 / no timestamps) are not migrated
+            self._conn.execute("DROP TABLE IF EXISTS embeddings")
+            self._conn.execute("DROP TABLE IF EXISTS embeddings_f32")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_vectors "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+            self._prune()
+
+    def _remember(self, items: Dict[str, np.ndarray]):
+        """Insert into the in-memory LRU, evicting the oldest entries once full"""
+        for key, vector in items.items():
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_size:
+            self._memory.popitem(last=False)
+
+    def _prune(self):
+        """Delete persisted vectors older than the TTL (blocking)"""
+        with self._db_lock:
+            deleted = self._conn.execute(
+                "DELETE FROM embedding_vectors WHERE created_at < ?",
+                (time.time() - self.ttl,)
+            ).rowcount
+            self._conn.commit()
+        self._last_pruned = time.monotonic()
+        if deleted:
+            logger.info(f"Pruned {deleted} expired embeddings")
+
+    def _load(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Read unexpired vectors from SQLite (blocking)"""
+        placeholders = ",".join("?" * len(keys))
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embedding_vectors "
+                f"WHERE key IN ({placeholders}) AND created_at >= ?",
+                [*keys, time.time() - self.ttl]
+            ).fetchall()
+        return {key: np.frombuffer(vector, dtype=np.float32) for key, vector in rows}
+
+    def _store(self, items: Dict[str, np.ndarray]):
+        """Write vectors to SQLite, pruning expired rows about once a day (blocking)"""
+        now = time.time()
+        rows = [(key, vector.tobytes(), now) for key, vector in items.items()]
+        with self._db_lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding_vectors (key, vector, created_at) VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+        if time.monotonic() - self._last_pruned > _PRUNE_INTERVAL_SECONDS:
+            self._prune()
+
+    async def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Return the cached vectors for whichever keys are present"""
+        found = {}
+        for key in keys:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                found[key] = vector
+
+        missing = [key for key in keys if key not in found]
+        if missing and self._conn is not None:
+            stored = await asyncio.to_thread(self._load, missing)
+            self._remember(stored)
+            found.update(stored)
+        return {key: vector.tolist() for key, vector in found.items()}
+
+    async def get(self, key: str) -> Optional[List[float]]:
+        """Return a single cached vector, if present"""
+        return (await self.get_many([key])).get(key)
+
+    async def set_many(self, items: Dict[str, List[float]]) -> Dict[str, List[float]]:
+        """Store vectors, returning them rounded to float32 exactly as a later hit would"""
+        if not items:
+            return {}
+        vectors = {key: np.asarray(vector, dtype=np.float32) for key, vector in items.items()}
+        self._remember(vectors)
+        if self._conn is not None:
+            await asyncio.to_thread(self._store, vectors)
+        logger.debug(f"Cached {len(items)} embeddings")
+        return {key: vector.tolist() for key, vector in vectors.items()}
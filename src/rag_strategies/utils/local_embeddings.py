@@ -0,0 +1,53 @@
+import asyncio
+from typing import List
+
+from rag_strategies.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+class LocalEmbeddings:
+    """In-process sentence-transformer embeddings with the same async interface as AsyncOpenAIEmbeddings"""
+
+    def __init__(self, model_name: str, batch_size: int = 128):
+        # Optional dependency: pip install rag_strategies[local]
+        from sentence_transformers import SentenceTransformer
+
+        self.model = model_name
+        self.batch_size = batch_size
+        # Picks CUDA when available, otherwise CPU
+        self._model = SentenceTransformer(model_name)
+        logger.info(f"Loaded local embeddings model {model_name} on {self._model.device}")
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        embeddings = self._model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        )
+        return embeddings.tolist()
+
+    async def warmup(self):
+        """Run one encode so the first real request doesn't pay lazy initialization"""
+        await asyncio.to_thread(self._encode, ["warmup"])
+
+    async def embed_query(self, text: str) -> List[float]:
+        """Async embedding for single text"""
+        try:
+            embeddings = await asyncio.to_thread(self._encode, [text])
+            return embeddings[0]
+        except Exception as e:
+            logger.error(f"Error in embed_query: {str(e)}")
+            raise
+
+    async def embed_query_batched(self, text: str) -> List[float]:
+        """Same as embed_query; local encoding has no per-request round trip to coalesce"""
+        return await self.embed_query(text)
+
+    async def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Async embedding for multiple texts, encoded in batches off the event loop"""
+        try:
+            return await asyncio.to_thread(self._encode, texts)
+        except Exception as e:
+            logger.error(f"Error in embed_documents: {str(e)}")
+            raise
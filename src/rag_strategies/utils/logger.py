@@ -1,39 +1,50 @@
+import atexit
 import logging
+import queue
 import sys
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 
+from rag_strategies.config import settings
+
+_LOG_DIR = Path("logs")
+_LOG_DIR.mkdir(exist_ok=True)
+_LOG_FILE = _LOG_DIR / f"{datetime.now():%Y-%m-%d}.log"
+
+_file_handler = logging.FileHandler(_LOG_FILE)
+_file_handler.setLevel(logging.DEBUG)
+_file_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+))
+
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setLevel(logging.INFO)
+_console_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+))
+
+# Loggers only enqueue records; a background thread does the file and console I/O
+_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+_queue_handler = QueueHandler(_log_queue)
+_listener = QueueListener(
+    _log_queue,
+    _file_handler,
+    _console_handler,
+    respect_handler_level=True
+)
+_listener.start()
+# Flush whatever is still queued on interpreter exit
+atexit.register(_listener.stop)
+
 def setup_logger(name: str) -> logging.Logger:
     logger = logging.getLogger(name)
-    
+
     if logger.handlers:
         return logger
-        
-    logger.setLevel(logging.DEBUG)
-
-    log_dir = Path("logs")
-    log_dir.mkdir(exist_ok=True)
-
-    file_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    console_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-
-    file_handler = logging.FileHandler(
-        f"logs/{datetime.now().strftime('%Y-%m-%d')}.log"
-    )
-    file_handler.setLevel(logging.DEBUG)
-    file_handler.setFormatter(file_formatter)
-
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(console_formatter)
-
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
 
+    logger.setLevel(settings.log_level.upper())
+    logger.addHandler(_queue_handler)
     logger.propagate = False
 
     return logger
@@ -1,34 +1,155 @@
+import asyncio
+import httpx
+from weakref import WeakKeyDictionary
+from openai import AsyncOpenAI
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain_core.globals import set_llm_cache
+from langchain_community.cache import SQLiteCache
 from rag_strategies.config import settings
+from rag_strategies.utils.embedding_cache import EmbeddingCache, embedding_key
+from rag_strategies.utils.local_embeddings import LocalEmbeddings
 from rag_strategies.utils.logger import setup_logger
 from rag_strategies.utils.ssl_utils import setup_ssl_certificates
 from threading import Lock
-from typing import List
+from typing import Dict, List, Set, Tuple, Union
 
 logging = setup_logger(__name__)
 setup_ssl_certificates()
 
+# Content-hash cache so repeated and unchanged texts are never re-embedded;
+# hot keys are served from memory, the rest from SQLite only when configured
+# (or enabled for ingestion via enable_embedding_cache)
+_DEFAULT_EMBEDDING_CACHE_PATH = ".rag_embedding_cache.db"
+_embedding_cache = (
+    EmbeddingCache(settings.embedding_cache_path, settings.embedding_memory_cache_size)
+    if settings.embedding_cache_path or settings.embedding_memory_cache_size else None
+)
+
+# Fail fast on unreachable or saturated upstreams; reads allow for long completions
+_OPENAI_TIMEOUT = httpx.Timeout(60.0, connect=5.0, write=10.0, pool=5.0)
+_OPENAI_MAX_RETRIES = 2
+
+_openai_semaphores: "WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = WeakKeyDictionary()
+
+def get_openai_semaphore() -> asyncio.Semaphore:
+    """Semaphore bounding concurrent OpenAI requests on the running event loop"""
+    loop = asyncio.get_running_loop()
+    semaphore = _openai_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(settings.openai_concurrency)
+        _openai_semaphores[loop] = semaphore
+    return semaphore
+
+# Concurrent embed_query_batched calls within this window are sent as one request
+_QUERY_BATCH_WINDOW = 0.01
+_QUERY_BATCH_MAX_SIZE = 64
+_query_batches: "WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[asyncio.Queue, asyncio.Task]]" = WeakKeyDictionary()
+# Strong references to in-flight flushes so they are not garbage collected mid-request
+_query_flushes: Set[asyncio.Task] = set()
+
 class AsyncOpenAIEmbeddings(OpenAIEmbeddings):
     """Async wrapper for OpenAI embeddings"""
     
+    async def warmup(self):
+        """Open the HTTPS connection with one uncached request"""
+        async with get_openai_semaphore():
+            await super().aembed_query("warmup")
+
     async def embed_query(self, text: str) -> List[float]:
         """Async embedding for single text"""
         try:
-            embeddings = await super().aembed_query(text)
+            key = embedding_key(self.model, text)
+            if _embedding_cache:
+                cached = await _embedding_cache.get(key)
+                if cached is not None:
+                    return cached
+
+            async with get_openai_semaphore():
+                embeddings = await super().aembed_query(text)
+            if _embedding_cache:
+                # Return the stored float32 rounding so hits and misses agree
+                embeddings = (await _embedding_cache.set_many({key: embeddings}))[key]
             return embeddings
         except Exception as e:
             logging.error(f"Error in embed_query: {str(e)}")
             raise
 
+    async def embed_query_batched(self, text: str) -> List[float]:
+        """Embed a single text, coalesced with concurrent callers into one batched request"""
+        loop = asyncio.get_running_loop()
+        batch = _query_batches.get(loop)
+        # A drain task that has finished (cancelled or failed) is replaced, not reused
+        if batch is None or batch[1].done():
+            queue = asyncio.Queue()
+            batch = (queue, loop.create_task(_drain_query_batches(queue)))
+            _query_batches[loop] = batch
+
+        future = loop.create_future()
+        batch[0].put_nowait((self, text, future))
+        return await future
+
+    async def _flush_query_batch(self, pending: List[Tuple[str, asyncio.Future]]):
+        """Embed one window of queued texts and resolve their callers"""
+        try:
+            embeddings = await self.embed_documents([text for text, _ in pending])
+            for (_, future), embedding in zip(pending, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+
     async def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """Async embedding for multiple texts"""
         try:
-            embeddings = await super().aembed_documents(texts)
-            return embeddings
+            if not _embedding_cache:
+                async with get_openai_semaphore():
+                    return await super().aembed_documents(texts)
+
+            keys = [embedding_key(self.model, text) for text in texts]
+            cached = await _embedding_cache.get_many(keys)
+
+            # Send only the uncached texts, in one batch
+            missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+            if missing:
+                async with get_openai_semaphore():
+                    new_embeddings = await super().aembed_documents(list(missing.values()))
+                fresh = dict(zip(missing.keys(), new_embeddings))
+                cached.update(await _embedding_cache.set_many(fresh))
+
+            return [cached[key] for key in keys]
         except Exception as e:
             logging.error(f"Error in embed_documents: {str(e)}")
             raise
 
+async def _drain_query_batches(queue: asyncio.Queue):
+    """Collect queued texts for up to one window and embed them together"""
+    loop = asyncio.get_running_loop()
+    while True:
+        pending = [await queue.get()]
+        deadline = loop.time() + _QUERY_BATCH_WINDOW
+        while len(pending) < _QUERY_BATCH_MAX_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Texts are embedded by the instance that queued them, one flush per instance
+        groups: Dict[int, Tuple[AsyncOpenAIEmbeddings, List[Tuple[str, asyncio.Future]]]] = {}
+        for embeddings, text, future in pending:
+            groups.setdefault(id(embeddings), (embeddings, []))[1].append((text, future))
+
+        # Each flush runs as its own task (bounded by the OpenAI semaphore in
+        # embed_documents), so a slow request never holds up the next window
+        for embeddings, items in groups.values():
+            flush = loop.create_task(embeddings._flush_query_batch(items))
+            _query_flushes.add(flush)
+            flush.add_done_callback(_query_flushes.discard)
+
 class OpenAIClient:
     _instance = None
     _lock = Lock()
@@ -43,37 +164,84 @@ class OpenAIClient:
     def __init__(self):
         if not self._initialized:
             logging.info("Initializing OpenAI client")
-            self._embeddings_model = AsyncOpenAIEmbeddings(
-                model=settings.openai_embedding_model,
-                openai_api_key=settings.openai_api_key
+            # One keep-alive HTTP/2 pool for chat and embeddings, so concurrent
+            # requests reuse TLS connections instead of opening new ones
+            self._http_client = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+                timeout=_OPENAI_TIMEOUT
+            )
+            if settings.local_embedding_model:
+                self._embeddings_model = LocalEmbeddings(settings.local_embedding_model)
+            else:
+                self._embeddings_model = AsyncOpenAIEmbeddings(
+                    model=settings.openai_embedding_model,
+                    openai_api_key=settings.openai_api_key,
+                    request_timeout=_OPENAI_TIMEOUT,
+                    max_retries=_OPENAI_MAX_RETRIES,
+                    http_async_client=self._http_client
+                )
+            # Raw SDK client for endpoints LangChain does not wrap (files, batches)
+            self._openai = AsyncOpenAI(
+                api_key=settings.openai_api_key,
+                timeout=_OPENAI_TIMEOUT,
+                max_retries=_OPENAI_MAX_RETRIES,
+                http_client=self._http_client
             )
             self._llm = ChatOpenAI(
                 model_name=settings.openai_model_name,
                 temperature=0.1,
                 openai_api_key=settings.openai_api_key,
                 max_tokens=4096,
-                request_timeout=120,
+                request_timeout=_OPENAI_TIMEOUT,
+                max_retries=_OPENAI_MAX_RETRIES,
                 top_p=0.95,
                 presence_penalty=0,
                 frequency_penalty=0,
-                streaming=False
+                streaming=False,
+                http_async_client=self._http_client
             )
             self._initialized = True
     
     @property
-    def embeddings(self) -> AsyncOpenAIEmbeddings:
+    def embeddings(self) -> Union[AsyncOpenAIEmbeddings, LocalEmbeddings]:
         return self._embeddings_model
     
     @property
     def llm(self) -> ChatOpenAI:
         return self._llm
 
+    @property
+    def openai(self) -> AsyncOpenAI:
+        return self._openai
+
+    async def aclose(self):
+        """Close the shared HTTP connection pool"""
+        await self._http_client.aclose()
+
 # Create single instance
 _client = OpenAIClient()
 
 # Public interface
-def get_embeddings_model() -> AsyncOpenAIEmbeddings:
+def enable_llm_cache():
+    """Cache identical prompts on disk; for ingestion only, the API must not persist prompts"""
+    if settings.llm_cache_path:
+        set_llm_cache(SQLiteCache(database_path=settings.llm_cache_path))
+
+def enable_embedding_cache():
+    """Persist embeddings on disk; the API only does so when embedding_cache_path is set"""
+    global _embedding_cache
+    path = settings.embedding_cache_path or _DEFAULT_EMBEDDING_CACHE_PATH
+    _embedding_cache = EmbeddingCache(path, settings.embedding_memory_cache_size)
+
+def get_embeddings_model() -> Union[AsyncOpenAIEmbeddings, LocalEmbeddings]:
     return _client.embeddings
 
 def get_llm() -> ChatOpenAI:
     return _client.llm
+
+def get_openai_client() -> AsyncOpenAI:
+    return _client.openai
+
+async def close_openai_client():
+    await _client.aclose()
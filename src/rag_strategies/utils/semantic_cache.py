@@ -0,0 +1,105 @@
+import time
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+from rag_strategies.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+def _normalize(embedding: List[float]) -> np.ndarray:
+    """L2-normalize an embedding so a dot product is cosine similarity"""
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def _quantize(vector: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Symmetric int8 quantization scaled by the vector's max magnitude"""
+    max_abs = float(np.max(np.abs(vector)))
+    scale = max_abs / 127 if max_abs else 1.0
+    return np.round(vector / scale).astype(np.int8), scale
+
+class SemanticCache:
+    """In-memory cache that returns a stored value for near-duplicate embeddings"""
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_size: int = 1024,
+        quantize: bool = False,
+        ttl: Optional[float] = None
+    ):
+        self.threshold = threshold
+        self.max_size = max_size
+        # With quantize set, rows are kept as int8 plus a per-row scale (4x less memory)
+        self.quantize = quantize
+        # With ttl set (seconds), entries stop matching once stale and are evicted first
+        self.ttl = ttl
+        self._expires_at: Optional[np.ndarray] = None
+        self._matrix: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._values: List[Any] = []
+        self._last_used: Optional[np.ndarray] = None
+        self._tick = 0
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def _scores(self, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity of the query against every row (-inf once expired)"""
+        if not self.quantize:
+            scores = self._matrix @ query
+        else:
+            query_q, query_scale = _quantize(query)
+            dots = np.einsum('nd,d->n', self._matrix, query_q, dtype=np.int32)
+            scores = dots * (self._scales * query_scale)
+        if self.ttl:
+            scores = np.where(self._expires_at > time.monotonic(), scores, -np.inf)
+        return scores
+
+    def lookup(self, embedding: List[float]) -> Optional[Any]:
+        """Return the closest cached value if its similarity clears the threshold"""
+        if not self._values:
+            return None
+
+        # An exhaustive scan: at ~1k rows one matrix-vector product is well under 1 ms
+        query = _normalize(embedding)
+        scores = self._scores(query)
+        best = int(np.argmax(scores))
+        score = scores[best]
+
+        if score >= self.threshold:
+            logger.debug(f"Semantic cache hit (similarity {score:.3f})")
+            self._tick += 1
+            self._last_used[best] = self._tick
+            return self._values[best]
+        return None
+
+    def add(self, embedding: List[float], value: Any):
+        """Store a value, evicting the least recently used entry once full"""
+        normalized = _normalize(embedding)
+        row, scale = _quantize(normalized) if self.quantize else (normalized, 1.0)
+        now = time.monotonic()
+        expires_at = now + self.ttl if self.ttl else np.inf
+        self._tick += 1
+        if self._matrix is None:
+            self._matrix = row[None, :]
+            self._scales = np.array([scale], dtype=np.float32)
+            self._last_used = np.array([self._tick], dtype=np.int64)
+            self._expires_at = np.array([expires_at], dtype=np.float64)
+            self._values.append(value)
+        elif len(self._values) < self.max_size:
+            self._matrix = np.vstack([self._matrix, row])
+            self._scales = np.append(self._scales, np.float32(scale))
+            self._last_used = np.append(self._last_used, self._tick)
+            self._expires_at = np.append(self._expires_at, expires_at)
+            self._values.append(value)
+        else:
+            # Overwrite an expired row if there is one, otherwise the stalest row, in place
+            expired = np.flatnonzero(self._expires_at <= now)
+            slot = int(expired[0]) if expired.size else int(np.argmin(self._last_used))
+            self._matrix[slot] = row
+            self._scales[slot] = scale
+            self._last_used[slot] = self._tick
+            self._expires_at[slot] = expires_at
+            self._values[slot] = value
@@ -0,0 +1,18 @@
+import time
+from datetime import datetime, timezone
+from typing import Tuple
+
+# (epoch second, ISO string) of the last formatted timestamp
+_last_timestamp: Tuple[int, str] = (-1, "")
+
+def utc_timestamp() -> str:
+    """Current UTC time as an ISO 8601 string, formatted at most once per second"""
+    global _last_timestamp
+    second = int(time.time())
+    cached_second, cached = _last_timestamp
+    if second == cached_second:
+        return cached
+
+    formatted = datetime.fromtimestamp(second, timezone.utc).isoformat()
+    _last_timestamp = (second, formatted)
+    return formatted
@@ -0,0 +1,14 @@
+import os
+
+# Settings are read when rag_strategies is imported; placeholders let the
+# package load without a .env (nothing in these tests reaches OpenAI or MongoDB)
+for name, value in {
+    "OPENAI_API_KEY": "test-key",
+    "OPENAI_MODEL_NAME": "gpt-4o-mini",
+    "OPENAI_EMBEDDING_MODEL": "text-embedding-3-small",
+    "OPENAI_EMBEDDING_DIMENSIONS": "1536",
+    "MONGODB_URI": "mongodb://localhost:27017",
+    "MONGODB_DB_NAME": "test",
+    "MONGODB_COLLECTION_NAME": "test",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,51 @@
+import pytest
+
+from rag_strategies.ingestion.chunker import SemanticChunker
+
+@pytest.fixture
+def chunker():
+    # _parse_labels never calls the models
+    return SemanticChunker(llm=object(), embeddings=object())
+
+def test_parses_one_label_per_line(chunker):
+    response = (
+        '{"id": 0, "type": "procedure", "is_procedure": true}\n'
+        '{"id": 1, "type": "definition", "is_procedure": false}\n'
+    )
+
+    labels = chunker._parse_labels(response)
+
+    assert set(labels) == {0, 1}
+    assert labels[0]["type"] == "procedure"
+    assert labels[1]["is_procedure"] is False
+
+@pytest.mark.parametrize("fence", ["```json", "```"])
+def test_strips_code_fences(chunker, fence):
+    response = f'{fence}\n{{"id": 0, "type": "overview"}}\n{{"id": 1, "type": "policy"}}\n```'
+
+    labels = chunker._parse_labels(response)
+
+    assert {i: label["type"] for i, label in labels.items()} == {0: "overview", 1: "policy"}
+
+def test_skips_malformed_lines(chunker):
+    response = "\n".join([
+        '{"id": 0, "type": "general"}',
+        'Here are the labels:',
+        '[1, 2, 3]',
+        '{"type": "policy"}',
+        '{"id": "2", "type": "policy"}',
+        '',
+        '{"id": 3, "type": "definition"}',
+    ])
+
+    labels = chunker._parse_labels(response)
+
+    assert set(labels) == {0, 3}
+
+def test_repairs_slightly_broken_json(chunker):
+    labels = chunker._parse_labels("{'id': 0, 'type': 'procedure', 'key_concepts': ['fees'],}")
+
+    assert labels[0]["key_concepts"] == ["fees"]
+
+def test_empty_response_has_no_labels(chunker):
+    assert chunker._parse_labels("") == {}
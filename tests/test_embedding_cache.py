@@ -0,0 +1,67 @@
+import asyncio
+import sqlite3
+
+import numpy as np
+
+from rag_strategies.utils import embedding_cache
+from rag_strategies.utils.embedding_cache import EmbeddingCache, embedding_key
+
+def test_embedding_key_depends_on_model_and_text():
+    assert embedding_key("m", "text") == embedding_key("m", "text")
+    assert embedding_key("m", "text") != embedding_key("other", "text")
+    assert embedding_key("m", "text") != embedding_key("m", "other")
+
+def test_memory_lru_evicts_least_recently_used():
+    cache = EmbeddingCache(memory_size=2)
+
+    async def scenario():
+        await cache.set_many({"a": [1.0], "b": [2.0]})
+        # Reading "a" makes "b" the eviction candidate
+        assert await cache.get("a") == [1.0]
+        await cache.set_many({"c": [3.0]})
+        return await cache.get_many(["a", "b", "c"])
+
+    assert asyncio.run(scenario()) == {"a": [1.0], "c": [3.0]}
+    assert all(isinstance(vector, np.ndarray) for vector in cache._memory.values())
+
+def test_set_many_returns_float32_rounding_seen_by_hits():
+    cache = EmbeddingCache()
+
+    async def scenario():
+        stored = await cache.set_many({"a": [0.1, 0.2]})
+        return stored, await cache.get("a")
+
+    stored, hit = asyncio.run(scenario())
+    assert stored == {"a": hit}
+    assert hit == np.asarray([0.1, 0.2], dtype=np.float32).tolist()
+
+def test_sqlite_round_trip(tmp_path):
+    path = str(tmp_path / "embeddings.db")
+    asyncio.run(EmbeddingCache(path).set_many({"a": [0.5, -0.25]}))
+
+    # A fresh instance has an empty LRU, so the hit must come from SQLite
+    assert asyncio.run(EmbeddingCache(path).get("a")) == [0.5, -0.25]
+    assert asyncio.run(EmbeddingCache(path).get("missing")) is None
+
+def test_expired_rows_are_ignored_and_pruned(tmp_path, monkeypatch):
+    path = str(tmp_path / "embeddings.db")
+    now = [1_000_000.0]
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: now[0])
+    asyncio.run(EmbeddingCache(path, ttl=60).set_many({"a": [1.0]}))
+
+    now[0] += 61
+    assert asyncio.run(EmbeddingCache(path, ttl=60).get("a")) is None
+    count = sqlite3.connect(path).execute("SELECT COUNT(*) FROM embedding_vectors").fetchone()[0]
+    assert count == 0
+
+def test_legacy_tables_are_dropped(tmp_path):
+    path = str(tmp_path / "embeddings.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE embeddings (key TEXT PRIMARY KEY, vector TEXT)")
+    conn.commit()
+    conn.close()
+
+    EmbeddingCache(path)
+
+    tables = {row[0] for row in sqlite3.connect(path).execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert tables == {"embedding_vectors"}
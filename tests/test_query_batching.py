@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from rag_strategies.utils import openai_client
+from rag_strategies.utils.openai_client import AsyncOpenAIEmbeddings
+
+@pytest.fixture
+def recorded(monkeypatch):
+    """Embeddings model whose batch endpoint records each request instead of calling OpenAI"""
+    requests = []
+
+    async def fake_embed_documents(self, texts):
+        requests.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    monkeypatch.setattr(AsyncOpenAIEmbeddings, "embed_documents", fake_embed_documents)
+    model = AsyncOpenAIEmbeddings(model="text-embedding-3-small", openai_api_key="test-key")
+    return model, requests
+
+def test_concurrent_calls_share_one_request(recorded):
+    embeddings, requests = recorded
+    async def scenario():
+        return await asyncio.gather(*[embeddings.embed_query_batched("x" * n) for n in range(1, 6)])
+
+    assert asyncio.run(scenario()) == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert requests == [["x", "xx", "xxx", "xxxx", "xxxxx"]]
+
+def test_calls_after_the_window_are_sent_separately(recorded):
+    embeddings, requests = recorded
+    async def scenario():
+        await embeddings.embed_query_batched("a")
+        await asyncio.sleep(openai_client._QUERY_BATCH_WINDOW * 2)
+        await embeddings.embed_query_batched("b")
+
+    asyncio.run(scenario())
+    assert requests == [["a"], ["b"]]
+
+def test_batches_are_capped_at_max_size(recorded, monkeypatch):
+    embeddings, requests = recorded
+    monkeypatch.setattr(openai_client, "_QUERY_BATCH_MAX_SIZE", 2)
+
+    async def scenario():
+        await asyncio.gather(*[embeddings.embed_query_batched(str(n)) for n in range(5)])
+
+    asyncio.run(scenario())
+    assert [len(request) for request in requests] == [2, 2, 1]
+
+def test_errors_fan_out_to_every_caller(monkeypatch):
+    async def failing_embed_documents(self, texts):
+        raise RuntimeError("upstream down")
+
+    monkeypatch.setattr(AsyncOpenAIEmbeddings, "embed_documents", failing_embed_documents)
+    model = AsyncOpenAIEmbeddings(model="text-embedding-3-small", openai_api_key="test-key")
+
+    async def scenario():
+        return await asyncio.gather(
+            *[model.embed_query_batched(str(n)) for n in range(3)],
+            return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+def test_finished_drain_task_is_replaced(recorded):
+    embeddings, _ = recorded
+
+    async def scenario():
+        await embeddings.embed_query_batched("a")
+        loop = asyncio.get_running_loop()
+        _, task = openai_client._query_batches[loop]
+        task.cancel()
+        await asyncio.sleep(0)
+        assert task.done()
+        return await embeddings.embed_query_batched("bb")
+
+    assert asyncio.run(scenario()) == [2.0]
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from rag_strategies.utils import semantic_cache
+from rag_strategies.utils.semantic_cache import SemanticCache
+
+BASIS = np.eye(8, dtype=np.float32)
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.monotonic for TTL tests"""
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache.time, "monotonic", lambda: now[0])
+    return now
+
+def test_lookup_hits_near_duplicate_and_misses_below_threshold():
+    cache = SemanticCache(threshold=0.95)
+    cache.add(BASIS[0].tolist(), "a")
+
+    near = BASIS[0] + 0.05 * BASIS[1]
+    assert cache.lookup(near.tolist()) == "a"
+    assert cache.lookup(BASIS[1].tolist()) is None
+
+def test_lookup_on_empty_cache_misses():
+    assert SemanticCache().lookup(BASIS[0].tolist()) is None
+
+def test_expired_entries_stop_matching(clock):
+    cache = SemanticCache(ttl=10)
+    cache.add(BASIS[0].tolist(), "a")
+    assert cache.lookup(BASIS[0].tolist()) == "a"
+
+    clock[0] += 11
+    assert cache.lookup(BASIS[0].tolist()) is None
+
+def test_full_cache_overwrites_least_recently_used():
+    cache = SemanticCache(max_size=2)
+    cache.add(BASIS[0].tolist(), "a")
+    cache.add(BASIS[1].tolist(), "b")
+    # Touch "a" so "b" becomes the least recently used
+    assert cache.lookup(BASIS[0].tolist()) == "a"
+
+    cache.add(BASIS[2].tolist(), "c")
+
+    assert len(cache) == 2
+    assert cache.lookup(BASIS[0].tolist()) == "a"
+    assert cache.lookup(BASIS[1].tolist()) is None
+    assert cache.lookup(BASIS[2].tolist()) == "c"
+
+def test_full_cache_overwrites_expired_row_before_lru(clock):
+    cache = SemanticCache(max_size=2, ttl=10)
+    cache.add(BASIS[0].tolist(), "a")
+    clock[0] += 5
+    cache.add(BASIS[1].tolist(), "b")
+    # "a" is the most recently used but has expired; "b" is still live
+    clock[0] += 6
+    cache.lookup(BASIS[0].tolist())
+
+    cache.add(BASIS[2].tolist(), "c")
+
+    assert cache.lookup(BASIS[1].tolist()) == "b"
+    assert cache.lookup(BASIS[2].tolist()) == "c"
+
+def test_quantized_scores_track_float_scores():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(32, 64)).astype(np.float32)
+    query = vectors[0] + 0.1 * rng.normal(size=64).astype(np.float32)
+
+    exact = SemanticCache()
+    quantized = SemanticCache(quantize=True)
+    for i, vector in enumerate(vectors):
+        exact.add(vector.tolist(), i)
+        quantized.add(vector.tolist(), i)
+
+    assert quantized._matrix.dtype == np.int8
+    normalized = semantic_cache._normalize(query.tolist())
+    np.testing.assert_allclose(quantized._scores(normalized), exact._scores(normalized), atol=0.02)
+    assert quantized.lookup(query.tolist()) == exact.lookup(query.tolist()) == 0